@@ -1,6 +1,6 @@
 import numpy as np
 import taichi as ti
-ti.init(arch=ti.gpu)
+ti.init(arch=ti.gpu, offline_cache=True)
 
 num_digits = 4
 
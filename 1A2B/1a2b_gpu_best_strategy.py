@@ -1,15 +1,30 @@
 from multiprocessing import cpu_count
 cpu_count = cpu_count()
+import math
 import time
-from typing import Dict, Tuple
+from typing import Tuple
 import numpy as np
 import taichi as ti
-ti.init(arch=ti.gpu, device_memory_GB=3)
+import feedback_table_file
+import strategy_book
+from scoring import EXPECTED_SIZE, ENTROPY, WORST_CASE, PARTITIONS, worst_score, print_statistics
+from scoring_kernels import popcount, add_feedback_group
+ti.init(arch=ti.gpu, device_memory_GB=0.5, offline_cache=True)  # reuses the kernels compiled by former runs
 
 num_digits = 4
 num_numbers = 10 ** num_digits
+num_valid_numbers = math.perm(10, num_digits)  # 5040 numbers without duplicating digit
+num_feedback_codes = (num_digits + 1) ** 2  # feedback code = A * (num_digits + 1) + B
+win_feedback_code = num_digits * (num_digits + 1)  # 4A0B
+feedback_codes = [a * (num_digits + 1) + b for a in range(num_digits + 1) for b in range(num_digits + 1 - a)
+                  if not (a == num_digits - 1 and b == 1)]  # (3A1B is impossible)
+num_feedback_slots = len(feedback_codes)  # 14 feedback codes for 4 digits
+num_bitset_words = (num_valid_numbers + 31) // 32  # 158 uint32 words for 5040 numbers
+turns_per_sync = 8  # turns launched before checking whether automated games are finished
 
 valid_guesses = ti.field(dtype=ti.uint8, shape=num_numbers)
+valid_numbers = ti.field(dtype=ti.int32, shape=num_valid_numbers)  # [123, 124, ..., 9876]
+number_to_index = ti.field(dtype=ti.int32, shape=num_numbers)  # -1 for numbers with duplicating digits
 digits = ti.field(dtype=ti.uint8, shape=(num_numbers, num_digits))
 """
 digits = [
@@ -20,9 +35,35 @@ digits = [
     ...
 ]
 """
-guess_to_answer_A_and_B_sum = ti.field(dtype=ti.uint8, shape=(num_numbers, num_numbers, 2))
-remaining_guesses_if_guess_this = ti.field(dtype=ti.uint32, shape=num_numbers)
-A_and_B = ti.field(dtype=ti.uint8, shape=(10 ** num_digits, 2))
+feedback_table = None
+"""
+feedback_table[guess_index, solution_index] = feedback_code(valid_numbers[solution_index], valid_numbers[guess_index])
+Around 25 MB, saved by `feedback_table_file` and loaded instead of being computed again.
+Passed to the kernels as an ndarray: on the CPU, the read-only memory map of the saved file, which is not copied,
+so that all the processes of simulate_parallel.py share the same pages. Otherwise, a ti.ndarray uploaded once.
+"""
+feedback_code_to_slot = ti.field(dtype=ti.int32, shape=num_feedback_codes)  # feedback_codes.index(code), or -1
+feedback_masks = None
+"""
+feedback_masks[guess_index, slot]: bitset of the numbers answering feedback_codes[slot] to the guess. Around 45 MB,
+saved and passed to the kernels like `feedback_table`
+"""
+candidate_bits = ti.field(dtype=ti.uint32, shape=num_bitset_words)
+"""
+bit (index % 32) of candidate_bits[index // 32] is 1 if valid_numbers[index] is still a possible solution
+"""
+num_candidates = ti.field(dtype=ti.int32, shape=())
+secret = ti.field(dtype=ti.int32, shape=())  # index of the solution of an automated game
+guess_count = ti.field(dtype=ti.int32, shape=())
+current_guess = ti.field(dtype=ti.int32, shape=())  # index of the guess of this turn, or -1 after the game
+feedback_histogram = ti.field(dtype=ti.int32, shape=(num_valid_numbers, num_feedback_codes))
+"""
+feedback_histogram[guess_index, code]: amount of the remaining candidates answering `code` to the guess
+"""
+guess_scores = ti.field(dtype=ti.float32, shape=num_valid_numbers)
+best_score = ti.field(dtype=ti.float32, shape=())
+best_guess = ti.field(dtype=ti.int32, shape=())
+initialized = False  # the fields are allocated and filled by the first kernel launched by `ensure_initialized()`
 
 
 @ti.func
@@ -55,89 +96,450 @@ def no_duplicate_digits():
 
 
 @ti.func
-def compute_A_and_B():
-    guess_to_answer_A_and_B_sum.fill(0)
-    for solution in range(num_numbers):
-        if valid_guesses[solution] != 0:
-            ti.loop_config(block_dim=128, parallelize=cpu_count)
-            for guess in range(num_numbers):
-                if valid_guesses[guess] != 0:
-                    for d_guess in ti.static(range(num_digits)):
-                        vectorA = ti.Vector([0] * num_digits, dt=ti.uint8)
-                        vectorB = ti.Vector([0] * num_digits, dt=ti.uint8)
-                        if digits[solution, d_guess] == digits[guess, d_guess]:
-                            vectorA[d_guess] = ti.cast(1, ti.uint8)
-                        for d_solution in ti.static(range(num_digits)):
-                            if d_solution != d_guess and digits[solution, d_solution] == digits[guess, d_guess]:
-                                vectorB[d_guess] = ti.cast(1, ti.uint8)
-                        sum_vectorA = vectorA.sum()
-                        guess_to_answer_A_and_B_sum[solution, guess, 0] = sum_vectorA
-                        guess_to_answer_A_and_B_sum[guess, solution, 0] = sum_vectorA
-                        sum_vectorB = vectorB.sum()
-                        guess_to_answer_A_and_B_sum[solution, guess, 1] = sum_vectorB
-                        guess_to_answer_A_and_B_sum[guess, solution, 1] = sum_vectorB
+def feedback_code(solution, guess) -> int:
+    """
+    :param solution: 8317
+    :param guess: 2708
+    :return: A * (num_digits + 1) + B, e.g. 0 * 5 + 2 for 0A2B
+    """
+    A = 0
+    B = 0
+    for d in ti.static(range(num_digits)):
+        if digits[solution, d] == digits[guess, d]:
+            A += 1
+        for d_inner in ti.static(range(num_digits)):
+            if d != d_inner and digits[solution, d] == digits[guess, d_inner]:
+                B += 1
+    return A * (num_digits + 1) + B
+
+
+@ti.kernel
+def compute_feedback_table(table: ti.types.ndarray()):
+    for guess_index, solution_index in ti.ndrange(num_valid_numbers, num_valid_numbers):
+        table[guess_index, solution_index] = ti.cast(
+            feedback_code(valid_numbers[solution_index], valid_numbers[guess_index]), ti.uint8)
+
+
+@ti.func
+def bit_of(index) -> ti.uint32:
+    return ti.cast(1, ti.uint32) << ti.cast(index & 31, ti.uint32)
+
+
+@ti.func
+def is_candidate(index) -> ti.int32:
+    return ti.cast((candidate_bits[index >> 5] & bit_of(index)) != 0, ti.int32)
+
+
+@ti.func
+def all_numbers_bits(word) -> ti.uint32:
+    bits = ~ti.cast(0, ti.uint32)
+    if (word + 1) * 32 > num_valid_numbers:
+        bits = (ti.cast(1, ti.uint32) << ti.cast(num_valid_numbers - word * 32, ti.uint32)) - ti.cast(1, ti.uint32)
+    return bits
+
+
+@ti.kernel
+def compute_feedback_masks(table: ti.types.ndarray(), masks: ti.types.ndarray()):
+    # each thread writes whole words of all the slots, instead of an atomic OR for each pair of numbers
+    for guess_index, word in ti.ndrange(num_valid_numbers, num_bitset_words):
+        bits = ti.Vector([0] * num_feedback_slots, dt=ti.uint32)
+        for bit in range(32):
+            solution_index = word * 32 + bit
+            if solution_index < num_valid_numbers:
+                code = ti.cast(table[guess_index, solution_index], ti.int32)
+                for slot in ti.static(range(num_feedback_slots)):
+                    if code == feedback_codes[slot]:
+                        bits[slot] |= bit_of(bit)
+        for slot in ti.static(range(num_feedback_slots)):
+            masks[guess_index, slot, word] = bits[slot]
 
 
 @ti.kernel
 def initialize_one_game():
-    valid_guesses.fill(1)
-    no_duplicate_digits()
+    for word in candidate_bits:
+        candidate_bits[word] = all_numbers_bits(word)
+    num_candidates[None] = num_valid_numbers
 
 
 @ti.kernel
-def initialize():
+def new_game(solution: ti.int32):
+    """
+    :param solution: the number to be guessed by `play_turn`. e.g. 8317
+    """
+    for word in candidate_bits:
+        candidate_bits[word] = all_numbers_bits(word)
+    num_candidates[None] = num_valid_numbers
+    secret[None] = number_to_index[solution]
+    guess_count[None] = 0
+
+
+@ti.kernel
+def initialize_digits():
     get_digits()
-    compute_A_and_B()
     valid_guesses.fill(1)
     no_duplicate_digits()
 
 
-@ti.kernel
-def reduce_possible_guesses(guess: ti.uint32, actual_A: ti.uint8, actual_B: ti.uint8):
+def initialize(directory: str = feedback_table_file.default_directory):
+    """
+    :param directory: where the feedback table and masks are loaded from, or saved to after being computed
+    """
+    global initialized, feedback_table, feedback_masks
+    initialize_digits()
+    valid_numbers_np = np.where(valid_guesses.to_numpy() != 0)[0].astype(np.int32)
+    valid_numbers.from_numpy(valid_numbers_np)
+    number_to_index_np = np.full(num_numbers, -1, dtype=np.int32)
+    number_to_index_np[valid_numbers_np] = np.arange(num_valid_numbers, dtype=np.int32)
+    number_to_index.from_numpy(number_to_index_np)
+    table = feedback_table_file.load(num_digits, num_valid_numbers, directory)
+    if table is None:
+        feedback_table = ti.ndarray(dtype=ti.uint8, shape=(num_valid_numbers, num_valid_numbers))
+        compute_feedback_table(feedback_table)
+        feedback_table_file.save(num_digits, feedback_table.to_numpy(), directory)
+    else:
+        feedback_table = kernel_array(table, ti.uint8)
+    feedback_code_to_slot_np = np.full(num_feedback_codes, -1, dtype=np.int32)
+    feedback_code_to_slot_np[feedback_codes] = np.arange(num_feedback_slots, dtype=np.int32)
+    feedback_code_to_slot.from_numpy(feedback_code_to_slot_np)
+    masks = feedback_table_file.load_masks(num_digits, num_valid_numbers, directory)
+    if masks is None:
+        feedback_masks = ti.ndarray(dtype=ti.uint32, shape=(num_valid_numbers, num_feedback_slots, num_bitset_words))
+        compute_feedback_masks(feedback_table, feedback_masks)
+        feedback_table_file.save_masks(num_digits, feedback_masks.to_numpy(), directory)
+    else:
+        feedback_masks = kernel_array(masks, ti.uint32)
+    initialize_one_game()
+    initialized = True
+
+
+def kernel_array(array: np.ndarray, dtype):
+    """
+    :param array: e.g. a read-only memory map
+    :return: the array itself on the CPU, which the kernels read without copying, or its copy on the device
+    """
+    if ti.lang.impl.current_cfg().arch in (ti.x64, ti.arm64):
+        return array
+    device_array = ti.ndarray(dtype=dtype, shape=array.shape)
+    device_array.from_numpy(np.ascontiguousarray(array))
+    return device_array
+
+
+def feedback_table_numpy() -> np.ndarray:
+    """
+    :return: `feedback_table` on the host
+    """
+    return feedback_table if isinstance(feedback_table, np.ndarray) else feedback_table.to_numpy()
+
+
+def ensure_initialized(directory: str = feedback_table_file.default_directory):
+    """
+    Initializes on the first call only, so that importing this script costs only `ti.init`
+    """
+    if not initialized:
+        initialize(directory)
+
+
+def set_candidates(candidates: np.ndarray):
+    """
+    :param candidates: indices of `valid_numbers` of the possible solutions
+    """
+    is_candidate_np = np.zeros(num_bitset_words * 32, dtype=bool)
+    is_candidate_np[candidates] = True
+    candidate_bits.from_numpy(np.packbits(is_candidate_np, bitorder='little').view('<u4').astype(np.uint32))
+    num_candidates[None] = candidates.shape[0]
+
+
+@ti.func
+def remove_candidates(slot, masks: ti.template()):
+    """
+    Keeps the candidates answering feedback_codes[slot] to `current_guess`, except the guess itself
+    :param masks: `feedback_masks`
+    """
+    for word in candidate_bits:
+        if current_guess[None] >= 0:
+            bits = ti.cast(0, ti.uint32)
+            if slot >= 0:
+                bits = candidate_bits[word] & masks[current_guess[None], slot, word]
+            if word == current_guess[None] >> 5:
+                bits &= ~bit_of(current_guess[None])
+            candidate_bits[word] = bits
+            num_candidates[None] += popcount(bits)
+
+
+def reduce_possible_guesses(guess: int, actual_A: int, actual_B: int):
     """
     :param guess: guessed number. e.g. 2043
     :param actual_A: num of same digit in the answer at correct position
     :param actual_B: num of same digit in the answer but not at correct position
     """
-    valid_guesses[guess] = 0
-    for num in valid_guesses:
-        if valid_guesses[num] == 1:
-            A_and_B[num, 0] = 0
-            A_and_B[num, 1] = 0
-            vectorA = ti.Vector([0] * num_digits)
-            vectorB = ti.Vector([0] * num_digits)
-            for d in ti.static(range(num_digits)):
-                if digits[num, d] == digits[guess, d]:
-                    vectorA[d] = 1
-                for d_inner in ti.static(range(num_digits)):
-                    if d != d_inner and digits[num, d] == digits[guess, d_inner]:
-                        vectorB[d_inner] = 1
-            A_and_B[num, 0] = vectorA.sum()
-            A_and_B[num, 1] = vectorB.sum()
-            if A_and_B[num, 0] != actual_A or A_and_B[num, 1] != actual_B:
-                valid_guesses[num] = 0
+    _reduce_possible_guesses(guess, actual_A, actual_B, feedback_masks)
 
 
+@ti.kernel
+def _reduce_possible_guesses(guess: ti.uint32, actual_A: ti.uint8, actual_B: ti.uint8, masks: ti.types.ndarray()):
+    current_guess[None] = number_to_index[ti.cast(guess, ti.int32)]
+    num_candidates[None] = 0
+    remove_candidates(feedback_code_to_slot[ti.cast(actual_A, ti.int32) * (num_digits + 1) + ti.cast(actual_B, ti.int32)],
+                      masks)
+
+
+@ti.func
+def score_feedback_histogram(histogram, criterion: ti.template()) -> ti.float32:
+    """
+    :param histogram: ti.Vector of the amount of candidates answering each feedback code to a guess
+    :param criterion: EXPECTED_SIZE, ENTROPY, WORST_CASE or PARTITIONS
+    :return: score of the guess. The lower, the better
+    """
+    score = 0.0
+    for code in ti.static(feedback_codes):
+        score = add_feedback_group(score, ti.cast(histogram[code], ti.float32), criterion)
+    return score
+
+
+@ti.func
+def find_best_guess_index(criterion: ti.template(), table: ti.template()):
+    """
+    :param table: `feedback_table`
+    Writes the index of the guess with the best score into best_guess[None], plus `num_valid_numbers` if it is not a candidate.
+    Among the guesses with the best score, a candidate is preferred, and then the smallest number.
+    Does nothing after the game.
+    """
+    best_score[None] = worst_score
+    best_guess[None] = 2 ** 31 - 1
+    # the loops are empty after the game, so that the extra turns launched by `play_game` cost almost nothing
+    num_guesses = ti.select(num_candidates[None] > 0, num_valid_numbers, 0)
+    for guess_index, code in ti.ndrange(num_guesses, num_feedback_codes):
+        feedback_histogram[guess_index, code] = 0
+    ti.loop_config(block_dim=128, parallelize=cpu_count)
+    for guess_index, solution_index in ti.ndrange(num_guesses, num_valid_numbers):
+        if is_candidate(solution_index):
+            feedback_histogram[guess_index, ti.cast(table[guess_index, solution_index], ti.int32)] += 1
+    for guess_index in range(num_guesses):
+        histogram = ti.Vector([0] * num_feedback_codes)
+        for code in ti.static(feedback_codes):
+            histogram[code] = feedback_histogram[guess_index, code]
+        guess_scores[guess_index] = score_feedback_histogram(histogram, criterion)
+        ti.atomic_min(best_score[None], guess_scores[guess_index])
+    for guess_index in range(num_guesses):
+        if guess_scores[guess_index] == best_score[None]:
+            ti.atomic_min(best_guess[None], guess_index + (1 - is_candidate(guess_index)) * num_valid_numbers)
+
+
+def find_best_guess(criterion: int) -> int:
+    """
+    :param criterion: EXPECTED_SIZE, ENTROPY, WORST_CASE or PARTITIONS
+    :return: the number with the best score
+    """
+    return _find_best_guess(criterion, feedback_table)
+
+
+@ti.kernel
+def _find_best_guess(criterion: ti.template(), table: ti.types.ndarray()) -> ti.int32:
+    find_best_guess_index(criterion, table)
+    return valid_numbers[best_guess[None] % num_valid_numbers]
+
+
+def play_turn(criterion: int):
+    """
+    Guesses the best number against `secret` without returning to the host. Does nothing after the game.
+    """
+    _play_turn(criterion, feedback_table, feedback_masks)
+
 
 @ti.kernel
-def find_best_guess():
+def _play_turn(criterion: ti.template(), table: ti.types.ndarray(), masks: ti.types.ndarray()):
+    find_best_guess_index(criterion, table)
+    slot = -1
+    current_guess[None] = -1
+    if num_candidates[None] > 0:
+        current_guess[None] = best_guess[None] % num_valid_numbers
+        slot = feedback_code_to_slot[ti.cast(table[current_guess[None], secret[None]], ti.int32)]
+        guess_count[None] += 1
+        num_candidates[None] = 0
+    remove_candidates(slot, masks)
+
+
+def play_game(solution: int, criterion: int = EXPECTED_SIZE) -> int:
     """
-    :return: the expected amount of information that will be generated by each guess
+    :param solution: 8317
+    :return: amount of guesses to find the solution
     """
-    remaining_guesses_if_guess_this.fill(0)
-    for actual_answer in range(num_numbers):
-        if valid_guesses[actual_answer] == 0:
-            remaining_guesses_if_guess_this[actual_answer] = ti.cast(2 ** 31 - 1, ti.uint32)
-        else:
-            ti.loop_config(block_dim=128, parallelize=cpu_count)
-            for next_guess in range(num_numbers):
-                for a in ti.static(range(num_digits + 1)):
-                    for b in ti.static(range(num_digits + 1 - a)):
-                        if guess_to_answer_A_and_B_sum[actual_answer, next_guess, 0] == a and guess_to_answer_A_and_B_sum[actual_answer, next_guess, 1] == b:
-                            remaining_guesses_if_guess_this[next_guess] += 1
+    ensure_initialized()
+    new_game(solution)
+    while True:
+        # the host waits for the device only once per `turns_per_sync` turns
+        for _ in range(turns_per_sync):
+            play_turn(criterion)
+        if num_candidates[None] == 0:
+            return guess_count[None]
+
+
+@ti.data_oriented
+class BatchedGames:
+    """
+    Plays `batch_size` games at once, keeping everything of every game on the device.
+    Candidates and guesses are indices of `valid_numbers`.
+    Each turn of all the live games is a single launch of `play_turn`.
+    """
+    
+    def __init__(self, batch_size: int, criterion: int = EXPECTED_SIZE):
+        ensure_initialized()
+        self.batch_size = batch_size
+        self.criterion = criterion
+        self.secrets = ti.field(dtype=ti.int32, shape=batch_size)
+        self.guess_count = ti.field(dtype=ti.int32, shape=batch_size)
+        # candidates[game, :num_candidates[game]] are the remaining possible solutions of a game
+        self.candidates = ti.field(dtype=ti.int16, shape=(batch_size, num_valid_numbers))
+        self.num_candidates = ti.field(dtype=ti.int32, shape=batch_size)
+        self.candidate_bits = ti.field(dtype=ti.uint32, shape=(batch_size, num_bitset_words))
+        # written for each turn
+        self.scores = ti.field(dtype=ti.float32, shape=(batch_size, num_valid_numbers))
+        self.best_score = ti.field(dtype=ti.float32, shape=batch_size)
+        self.best_guess = ti.field(dtype=ti.int32, shape=batch_size)
+        self.opening_guess = -1
+    
+    def play(self, secrets: np.ndarray) -> np.ndarray:
+        """
+        :param secrets: indices of `valid_numbers`, at most `batch_size` of them
+        :return: number of guesses used by each game
+        """
+        num_games = secrets.shape[0]
+        padded_secrets = np.full(self.batch_size, -1, dtype=np.int32)  # -1: no game
+        padded_secrets[:num_games] = secrets
+        self.secrets.from_numpy(padded_secrets)
+        self.new_games()
+        if self.opening_guess < 0:
+            # every game starts with the same candidates, so that the first guess is computed only once
+            self.opening_guess = self.find_opening_guess(feedback_table)
+        self.play_turn(self.opening_guess, feedback_table, feedback_masks)
+        while True:
+            for _ in range(turns_per_sync):
+                self.play_turn(-1, feedback_table, feedback_masks)
+            if not self.num_candidates.to_numpy().any():
+                break
+        return self.guess_count.to_numpy()[:num_games]
+    
+    @ti.kernel
+    def new_games(self):
+        for game, i in self.candidates:
+            self.candidates[game, i] = ti.cast(i, ti.int16)
+        for game, word in self.candidate_bits:
+            self.candidate_bits[game, word] = all_numbers_bits(word)
+        for game in self.secrets:
+            self.guess_count[game] = 0
+            self.num_candidates[game] = 0
+            if self.secrets[game] >= 0:
+                self.num_candidates[game] = num_valid_numbers
+            self.best_score[game] = worst_score
+            self.best_guess[game] = 2 ** 31 - 1
+    
+    @ti.func
+    def _score(self, game, guess_index, table: ti.template()):
+        """
+        :param table: `feedback_table`
+        :return: score of the guess with `criterion` against the candidates of the game
+        """
+        # histograms of all the games and guesses would not fit in memory; count in registers instead
+        histogram = ti.Vector([0] * num_feedback_codes)
+        for k in range(self.num_candidates[game]):
+            code = table[guess_index, ti.cast(self.candidates[game, k], ti.int32)]
+            for c in ti.static(feedback_codes):
+                if code == c:
+                    histogram[c] += 1
+        return score_feedback_histogram(histogram, ti.static(self.criterion))
+    
+    @ti.func
+    def _pick_best_guess(self, game, guess_index):
+        """Among the guesses with the best score, prefer a candidate, and then the smallest number"""
+        if self.scores[game, guess_index] == self.best_score[game]:
+            is_candidate_of_game = ti.cast((self.candidate_bits[game, guess_index >> 5] & bit_of(guess_index)) != 0, ti.int32)
+            ti.atomic_min(self.best_guess[game], guess_index + (1 - is_candidate_of_game) * num_valid_numbers)
+    
+    @ti.kernel
+    def find_opening_guess(self, table: ti.types.ndarray()) -> ti.int32:
+        for guess_index in range(num_valid_numbers):
+            self.scores[0, guess_index] = self._score(0, guess_index, table)
+            ti.atomic_min(self.best_score[0], self.scores[0, guess_index])
+        for guess_index in range(num_valid_numbers):
+            self._pick_best_guess(0, guess_index)
+        opening_guess = self.best_guess[0] % num_valid_numbers
+        self.best_score[0] = worst_score
+        self.best_guess[0] = 2 ** 31 - 1
+        return opening_guess
+    
+    @ti.func
+    def _find_best_guesses(self, opening_guess, table: ti.template()):
+        """
+        Finds the best guess of each live game into `best_guess`, unless every game guesses `opening_guess`
+        """
+        # the loops must stay at the outermost scope of the kernel to run in parallel
+        for game, guess_index in ti.ndrange(self.batch_size, num_valid_numbers):
+            if opening_guess < 0 and self.num_candidates[game] > 0:
+                self.scores[game, guess_index] = self._score(game, guess_index, table)
+                ti.atomic_min(self.best_score[game], self.scores[game, guess_index])
+        for game, guess_index in ti.ndrange(self.batch_size, num_valid_numbers):
+            if opening_guess < 0 and self.num_candidates[game] > 0:
+                self._pick_best_guess(game, guess_index)
+    
+    @ti.kernel
+    def find_best_guesses(self, table: ti.types.ndarray()):
+        """
+        Finds the best guess of each game with the candidates in `candidate_bits`, without playing it
+        """
+        for game in range(self.batch_size):
+            remaining = 0
+            for word in range(num_bitset_words):
+                for bit in range(32):
+                    if self.candidate_bits[game, word] & bit_of(bit) != 0:
+                        self.candidates[game, remaining] = ti.cast(word * 32 + bit, ti.int16)
+                        remaining += 1
+            self.num_candidates[game] = remaining
+            self.best_score[game] = worst_score
+            self.best_guess[game] = 2 ** 31 - 1
+        self._find_best_guesses(-1, table)
+    
+    def suggest(self, candidate_bits: np.ndarray) -> np.ndarray:
+        """
+        :param candidate_bits: bitsets of the candidates of at most `batch_size` games, shaped (games, num_bitset_words)
+        :return: index of the best guess of each game, or -1 if a game has no candidate
+        """
+        num_games = candidate_bits.shape[0]
+        padded_candidate_bits = np.zeros((self.batch_size, num_bitset_words), dtype=np.uint32)
+        padded_candidate_bits[:num_games] = candidate_bits
+        self.candidate_bits.from_numpy(padded_candidate_bits)
+        self.find_best_guesses(feedback_table)
+        best_guesses = self.best_guess.to_numpy()[:num_games]
+        return np.where(best_guesses < 2 ** 31 - 1, best_guesses % num_valid_numbers, -1)
+    
+    @ti.kernel
+    def play_turn(self, opening_guess: ti.int32, table: ti.types.ndarray(), masks: ti.types.ndarray()):
+        """
+        :param opening_guess: index of the guess made by every live game, or -1 to find the best guess for each game
+        """
+        self._find_best_guesses(opening_guess, table)
+        for game in range(self.batch_size):
+            if self.num_candidates[game] > 0:
+                guess_index = opening_guess
+                if opening_guess < 0:
+                    guess_index = self.best_guess[game] % num_valid_numbers
+                slot = feedback_code_to_slot[ti.cast(table[guess_index, self.secrets[game]], ti.int32)]
+                self.guess_count[game] += 1
+                for word in range(num_bitset_words):
+                    self.candidate_bits[game, word] &= masks[guess_index, slot, word]
+                self.candidate_bits[game, guess_index >> 5] &= ~bit_of(guess_index)
+                # keep the list of the remaining candidates for scoring
+                remaining = 0
+                ti.loop_config(serialize=True)
+                for k in range(self.num_candidates[game]):
+                    candidate = ti.cast(self.candidates[game, k], ti.int32)
+                    if self.candidate_bits[game, candidate >> 5] & bit_of(candidate) != 0:
+                        self.candidates[game, remaining] = ti.cast(candidate, ti.int16)
+                        remaining += 1
+                self.num_candidates[game] = remaining
+                self.best_score[game] = worst_score
+                self.best_guess[game] = 2 ** 31 - 1
 
 
-initialize()
 # ti.profiler.print_scoped_profiler_info()
 # print(digits)
 # print(initial_nums)
@@ -146,70 +548,129 @@ initialize()
 # print(result_guesses)
 
 
-def play_once():
-    while (valid_guesses_shape := np.where(valid_guesses.to_numpy() != 0)[0].shape[0]) > 0:
-        find_best_guess()
-        sorted_suggested_guesses = remaining_guesses_if_guess_this.to_numpy().argsort()
-        suggested_guess = int(sorted_suggested_guesses[0])
-        print(valid_guesses_shape)
-        print(str(sorted_suggested_guesses[0]).zfill(num_digits), end='\t')
+def play_once(criterion: int = EXPECTED_SIZE):
+    ensure_initialized()
+    initialize_one_game()
+    while num_candidates[None] > 0:
+        suggested_guess = find_best_guess(criterion)
+        print(num_candidates[None])
+        print(str(suggested_guess).zfill(num_digits), end='\t')
         A, B = map(int, input().split())
         reduce_possible_guesses(suggested_guess, A, B)
 
 
-def test():
+def test(criterion: int = EXPECTED_SIZE):
     print('You are testing the performance of this program')
     print('Call play_once() instead of test() to play 1A2B with IntelligentIthea using the best strategy')
-    print('1000 simulations cost around 15 seconds on RTX 2070 at 80 Watts')
+    print('Run benchmark.py to measure each kernel on all the available devices')
     print('Please wait for simulation...')
     import random
     
-    def gen_solution() -> Dict[int, int]:
-        digits = random.sample("0123456789", num_digits)  # ['3','6','2','0']
-        return {int(d): num_digits - i - 1 for i, d in enumerate(digits)}  # {3:3, 6:2, 2:1, 0:0}
-    
-    def gen_A_B(solution: Dict[int, int], guess: int) -> Tuple[int, int]:
-        guess_dict = dict()
-        for i in range(num_digits):
-            guess_dict[i] = guess % 10
-            guess = guess // 10
-        A, B = 0, 0
-        for k, v in guess_dict.items():
-            if k in solution:
-                if solution[k] == v:
-                    A += 1
-                else:
-                    B += 1
-        return A, B
+    def gen_solution() -> int:
+        return int(''.join(random.sample("0123456789", num_digits)))  # 3620
     
     initialize()
-    total_guesses = 0
-    max_guesses = 0
-    min_guesses = 100
     tries = 1000
+    guess_counts = np.zeros(tries, dtype=np.int32)
     start_time = time.time()
     for i in range(1, tries+1):
-        game_guesses = 0
-        solution = gen_solution()
-        initialize_one_game()
-        while (np.where(valid_guesses.to_numpy() != 0)[0].shape[0]) > 0:
-            find_best_guess()
-            sorted_suggested_guesses = remaining_guesses_if_guess_this.to_numpy().argsort()
-            suggested_guess = int(sorted_suggested_guesses[0])
-            total_guesses += 1
-            game_guesses += 1
-            A, B = gen_A_B(solution, suggested_guess)
-            reduce_possible_guesses(suggested_guess, A, B)
-        if game_guesses < min_guesses:
-            min_guesses = game_guesses
-        if game_guesses > max_guesses:
-            max_guesses = game_guesses
+        guess_counts[i - 1] = play_game(gen_solution(), criterion)
         if i % 100 == 0:
             print(f"Finished {i}-th game")
     end_time = time.time()
     print(f'time cost: {end_time - start_time} seconds with {tries} tries')
-    print(f'min: {min_guesses}, avg: {total_guesses/tries}, max: {max_guesses}')
+    print_statistics(guess_counts)
+
+
+def test_batched(tries: int = 10000, batch_size: int = 1000, seed: int = 0, criterion: int = EXPECTED_SIZE):
+    print('You are testing the performance of this program with many games on the device at once')
+    print('Please wait for simulation...')
+    rng = np.random.default_rng(seed)
+    games = BatchedGames(batch_size, criterion)  # initializes
+    guess_counts = []
+    start_time = time.time()
+    for first_game in range(0, tries, batch_size):
+        secrets = rng.integers(num_valid_numbers, size=min(batch_size, tries - first_game), dtype=np.int32)
+        guess_counts.append(games.play(secrets))
+        print(f"Finished {first_game + secrets.shape[0]}-th game")
+    end_time = time.time()
+    guess_counts = np.concatenate(guess_counts)
+    print(f'time cost: {end_time - start_time} seconds with {tries} tries')
+    print_statistics(guess_counts)
+
+
+def walk_strategy_tree(criterion: int = EXPECTED_SIZE) -> Tuple[strategy_book.StrategyBook, np.ndarray]:
+    """
+    Walks the whole strategy tree from the first guess through every feedback.
+    Each node of the tree is a set of candidates sharing the same feedbacks, whose best guess is found only once.
+    :return: the tree, and the amount of guesses to find each of `valid_numbers`
+    """
+    ensure_initialized()
+    table = feedback_table_numpy()
+    valid_numbers_np = valid_numbers.to_numpy()
+    number_to_index_np = number_to_index.to_numpy()
+    guesses = []
+    children = []
+    guess_counts = np.zeros(num_valid_numbers, dtype=np.int32)
+    candidates_of_nodes = [np.arange(num_valid_numbers)]
+    depth_of_nodes = [1]
+    node = 0
+    while node < len(candidates_of_nodes):
+        candidates = candidates_of_nodes[node]
+        candidates_of_nodes[node] = None
+        if candidates.shape[0] <= 2:
+            # no guess splits 2 candidates better than a candidate does
+            guess_index = candidates[0]
+        else:
+            set_candidates(candidates)
+            guess_index = number_to_index_np[find_best_guess(criterion)]
+        guesses.append(valid_numbers_np[guess_index])
+        node_children = np.full(num_feedback_codes, -1, dtype=np.int32)
+        codes = table[guess_index, candidates]
+        for code in np.unique(codes):
+            if code == win_feedback_code:
+                guess_counts[guess_index] = depth_of_nodes[node]
+            else:
+                node_children[code] = len(candidates_of_nodes)
+                candidates_of_nodes.append(candidates[codes == code])
+                depth_of_nodes.append(depth_of_nodes[node] + 1)
+        children.append(node_children)
+        node += 1
+    book = strategy_book.StrategyBook(num_digits, np.array(guesses, dtype=np.int32), np.stack(children))
+    return book, guess_counts
+
+
+def build_strategy_book(criterion: int = EXPECTED_SIZE, path: str = None) -> strategy_book.StrategyBook:
+    """
+    Walks the whole strategy tree, and saves it to `path`
+    """
+    if path is None:
+        path = strategy_book.path(num_digits, criterion)
+    start_time = time.time()
+    book, _ = walk_strategy_tree(criterion)
+    strategy_book.save(book, path)
+    print(f'{len(book)} nodes built in {time.time() - start_time} seconds, saved to {path}')
+    return book
+
+
+def evaluate_all(criterion: int = EXPECTED_SIZE) -> np.ndarray:
+    """
+    Plays against every possible solution, instead of random ones like `test()`.
+    Solutions sharing the same feedbacks share the same nodes of the strategy tree, which are scored only once.
+    :return: amount of guesses to find each of `valid_numbers`
+    """
+    print(f'You are evaluating the strategy against all the {num_valid_numbers} solutions')
+    start_time = time.time()
+    book, guess_counts = walk_strategy_tree(criterion)
+    end_time = time.time()
+    print(f'time cost: {end_time - start_time} seconds with {len(book)} nodes')
+    print_statistics(guess_counts)
+    return guess_counts
 
 
-# play_once()
-test()
\ No newline at end of file
+if __name__ == '__main__':
+    # play_once()
+    # test()
+    # build_strategy_book()
+    # evaluate_all()
+    test_batched()
\ No newline at end of file
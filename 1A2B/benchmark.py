@@ -0,0 +1,299 @@
+"""
+Benchmarks 1a2b_gpu_best_strategy.py on the CPU and every other available backend, and prints the results as JSON.
+
+Each backend is benchmarked in its own process, because 1a2b_gpu_best_strategy.py initializes taichi when imported.
+Every kernel call is wrapped by `ti.sync()`, so that the time of a kernel is not charged to the next transfer.
+The first call of a kernel includes its JIT compilation, which is reported separately from the later calls.
+The time to the first suggestion of a new process is measured twice for each backend: cold, without the offline
+cache of compiled kernels and without the saved feedback table, and then warm, reusing both.
+The `numpy` backend is mastermind_numpy.py, which is benchmarked in this process against `Mastermind` of taichi.
+
+python benchmark.py --tries 100 --output benchmark.json
+"""
+import argparse
+import importlib
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List
+import numpy as np
+import mastermind_numpy
+import simulate_parallel
+import strategy_book
+
+gpu_arch_names = ['cuda', 'vulkan', 'metal', 'opengl', 'dx11']
+
+
+class KernelTimer:
+
+    def __init__(self, ti):
+        self.ti = ti
+        self.records = {}
+
+    def call(self, name: str, kernel, *args):
+        self.ti.sync()
+        start_time = time.perf_counter()
+        result = kernel(*args)
+        self.ti.sync()
+        elapsed = time.perf_counter() - start_time
+        record = self.records.setdefault(name, {'calls': 0, 'first_call_seconds': elapsed, 'seconds': 0.0})
+        record['calls'] += 1
+        if record['calls'] > 1:
+            record['seconds'] += elapsed
+        return result
+
+    def report(self) -> Dict[str, Dict[str, Any]]:
+        """
+        :return: for each kernel, its calls, its JIT compilation time, and the time of its calls after the first one
+        """
+        report = {}
+        for name, record in self.records.items():
+            later_calls = record['calls'] - 1
+            mean_seconds = record['seconds'] / later_calls if later_calls > 0 else None
+            report[name] = {
+                'calls': record['calls'],
+                'jit_compile_seconds': record['first_call_seconds'] - (mean_seconds or 0.0),
+                'total_seconds': record['seconds'],
+                'mean_seconds': mean_seconds,
+            }
+        return report
+
+
+def benchmark_backend(tries: int, batch_size: int, criterion: int) -> Dict[str, Any]:
+    """
+    Benchmarks the backend selected by TI_ARCH in this process
+    """
+    start_time = time.perf_counter()
+    strategy = importlib.import_module('1a2b_gpu_best_strategy')
+    import_seconds = time.perf_counter() - start_time
+    ti = strategy.ti
+    timer = KernelTimer(ti)
+    results = {
+        'arch': ti.lang.impl.current_cfg().arch.name,
+        'taichi_version': '.'.join(map(str, ti.__version__)),
+        'num_digits': strategy.num_digits,
+        'criterion': criterion,
+        'tries': tries,
+        'batch_size': batch_size,
+    }
+    if results['arch'] != os.environ.get('TI_ARCH', results['arch']):
+        # taichi fell back to the CPU
+        return results
+
+    results['import_seconds'] = import_seconds
+    # the first initialization includes the JIT compilation of its kernels, unless they are in the offline cache
+    start_time = time.perf_counter()
+    strategy.ensure_initialized()
+    ti.sync()
+    results['first_initialize_seconds'] = time.perf_counter() - start_time
+    start_time = time.perf_counter()
+    strategy.initialize()
+    ti.sync()
+    results['initialize_seconds'] = time.perf_counter() - start_time
+
+    rng = np.random.default_rng(0)
+    solutions = strategy.valid_numbers.to_numpy()[rng.integers(strategy.num_valid_numbers, size=tries)]
+    transfers = {'seconds': 0.0, 'count': 0}
+
+    # one game at a time, driven by the host like test()
+    start_time = time.perf_counter()
+    for solution in solutions:
+        timer.call('initialize_one_game', strategy.initialize_one_game)
+        while True:
+            transfer_start_time = time.perf_counter()
+            remaining = strategy.num_candidates[None]
+            transfers['seconds'] += time.perf_counter() - transfer_start_time
+            transfers['count'] += 1
+            if remaining == 0:
+                break
+            guess = timer.call('find_best_guess', strategy.find_best_guess, criterion)
+            A, B = strategy_book.feedback(int(solution), guess, strategy.num_digits)
+            timer.call('reduce_possible_guesses', strategy.reduce_possible_guesses, guess, A, B)
+    results['host_loop_games_per_second'] = tries / (time.perf_counter() - start_time)
+
+    # one game at a time, without returning to the host during a game
+    start_time = time.perf_counter()
+    for solution in solutions:
+        timer.call('new_game', strategy.new_game, int(solution))
+        while True:
+            for _ in range(strategy.turns_per_sync):
+                timer.call('play_turn', strategy.play_turn, criterion)
+            transfer_start_time = time.perf_counter()
+            remaining = strategy.num_candidates[None]
+            transfers['seconds'] += time.perf_counter() - transfer_start_time
+            transfers['count'] += 1
+            if remaining == 0:
+                break
+    results['device_loop_games_per_second'] = tries / (time.perf_counter() - start_time)
+
+    # many games at once
+    games = strategy.BatchedGames(batch_size, criterion)
+    secrets = rng.integers(strategy.num_valid_numbers, size=batch_size, dtype=np.int32)
+    games.play(secrets)  # JIT compilation
+    ti.sync()
+    start_time = time.perf_counter()
+    games.play(secrets)
+    ti.sync()
+    results['batched_games_per_second'] = batch_size / (time.perf_counter() - start_time)
+
+    # the same games with mastermind.py, to be compared with mastermind_numpy.py
+    mastermind = importlib.import_module('mastermind')
+    game = mastermind.Mastermind(strategy.num_digits)
+    game.play(0, criterion)  # JIT compilation
+    ti.sync()
+    results['mastermind_games_per_second'] = benchmark_mastermind(game, tries, criterion)
+
+    results['kernels'] = timer.report()
+    results['host_transfers'] = {
+        'scalar_reads': transfers['count'],
+        'scalar_read_seconds': transfers['seconds'],
+    }
+    # on the CPU, the table is the memory map of the saved file, which is neither downloaded nor uploaded
+    start_time = time.perf_counter()
+    table = strategy.feedback_table_numpy()
+    results['host_transfers']['feedback_table_download_seconds'] = time.perf_counter() - start_time
+    start_time = time.perf_counter()
+    strategy.kernel_array(table, ti.uint8)
+    ti.sync()
+    results['host_transfers']['feedback_table_upload_seconds'] = time.perf_counter() - start_time
+    results['host_transfers']['feedback_table_bytes'] = table.nbytes
+    return results
+
+
+def benchmark_mastermind(game, tries: int, criterion: int) -> float:
+    """
+    :param game: `Mastermind` of mastermind.py or mastermind_numpy.py
+    :return: games per second
+    """
+    solutions = np.random.default_rng(0).integers(game.num_codes, size=tries)
+    start_time = time.perf_counter()
+    for solution in solutions:
+        game.play(int(solution), criterion)
+    return tries / (time.perf_counter() - start_time)
+
+
+def benchmark_numpy(tries: int, criterion: int) -> Dict[str, Any]:
+    """
+    Benchmarks mastermind_numpy.py in this process, without taichi
+    """
+    start_time = time.perf_counter()
+    game = mastermind_numpy.Mastermind(4)
+    results = {
+        'arch': 'numpy',
+        'numpy_version': np.__version__,
+        'num_digits': game.num_digits,
+        'criterion': criterion,
+        'tries': tries,
+        'initialize_seconds': time.perf_counter() - start_time,
+    }
+    results['mastermind_games_per_second'] = benchmark_mastermind(game, tries, criterion)
+    return results
+
+
+def benchmark_startup(criterion: int, directory: str) -> Dict[str, Any]:
+    """
+    Measures the time to the first suggestion in this process, like `play_once()`
+    :param directory: where the feedback table is loaded from, or saved to after being computed
+    """
+    start_time = time.perf_counter()
+    strategy = importlib.import_module('1a2b_gpu_best_strategy')
+    import_seconds = time.perf_counter() - start_time
+    strategy.ensure_initialized(directory)
+    strategy.ti.sync()
+    initialize_seconds = time.perf_counter() - start_time - import_seconds
+    strategy.initialize_one_game()
+    strategy.find_best_guess(criterion)
+    return {
+        'arch': strategy.ti.lang.impl.current_cfg().arch.name,
+        'import_seconds': import_seconds,
+        'initialize_seconds': initialize_seconds,
+        'first_suggestion_seconds': time.perf_counter() - start_time,
+    }
+
+
+def run_child(arch_name: str, arguments: List[str], output: str, env: Dict[str, str] = None) -> Dict[str, Any]:
+    """
+    Runs this script in a new process with TI_ARCH=arch_name
+    :return: the results written by the process to `output`, or None if it failed
+    """
+    child = subprocess.run([sys.executable, os.path.abspath(__file__), *arguments],
+                           env=dict(env or os.environ, TI_ARCH=arch_name), stdout=subprocess.DEVNULL)
+    if child.returncode != 0:
+        print(f'Failed to benchmark {arch_name}', file=sys.stderr)
+        return None
+    with open(output) as f:
+        return json.load(f)
+
+
+def benchmark(arch_names: List[str], tries: int, batch_size: int, criterion: int) -> List[Dict[str, Any]]:
+    """
+    :param arch_names: names of TI_ARCH, e.g. ['x64', 'cuda']. Unavailable backends are skipped
+    """
+    all_results = []
+    for arch_name in arch_names:
+        if arch_name == 'numpy':
+            results = benchmark_numpy(tries, criterion)
+            results['platform'] = platform.platform()
+            all_results.append(results)
+            continue
+        with tempfile.TemporaryDirectory() as directory:
+            output = os.path.join(directory, 'results.json')
+            results = run_child(arch_name, ['--child-output', output, '--tries', str(tries),
+                                            '--batch-size', str(batch_size), '--criterion', str(criterion)], output)
+            if results is None:
+                continue
+            if results['arch'] != arch_name:
+                # taichi fell back to the CPU
+                print(f'{arch_name} is not available', file=sys.stderr)
+                continue
+            # a new offline cache of compiled kernels, and a new directory without the feedback table
+            env = dict(os.environ, TI_OFFLINE_CACHE_FILE_PATH=os.path.join(directory, 'offline_cache'))
+            results['startup'] = {}
+            for start in ['cold', 'warm']:
+                output = os.path.join(directory, f'{start}.json')
+                start_time = time.perf_counter()
+                startup = run_child(arch_name, ['--startup-child-output', output, '--table-directory', directory,
+                                                '--criterion', str(criterion)], output, env)
+                if startup is None:
+                    break
+                startup['process_seconds'] = time.perf_counter() - start_time
+                results['startup'][start] = startup
+            else:
+                results['startup']['warm_to_cold_ratio'] = \
+                    results['startup']['warm']['first_suggestion_seconds'] / results['startup']['cold']['first_suggestion_seconds']
+        results['platform'] = platform.platform()
+        all_results.append(results)
+    return all_results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--arch', action='append', help='TI_ARCH to benchmark, or numpy. Default to all of them')
+    parser.add_argument('--tries', type=int, default=20, help='games played one at a time')
+    parser.add_argument('--batch-size', type=int, default=200, help='games played at once')
+    parser.add_argument('--criterion', type=int, default=0)
+    parser.add_argument('--output', help='write the JSON here instead of stdout')
+    parser.add_argument('--child-output', help=argparse.SUPPRESS)
+    parser.add_argument('--startup-child-output', help=argparse.SUPPRESS)
+    parser.add_argument('--table-directory', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child_output is not None:
+        results = benchmark_backend(args.tries, args.batch_size, args.criterion)
+        with open(args.child_output, 'w') as f:
+            json.dump(results, f)
+    elif args.startup_child_output is not None:
+        results = benchmark_startup(args.criterion, args.table_directory)
+        with open(args.startup_child_output, 'w') as f:
+            json.dump(results, f)
+    else:
+        arch_names = args.arch or [simulate_parallel.cpu_arch_name()] + gpu_arch_names + ['numpy']
+        report = json.dumps(benchmark(arch_names, args.tries, args.batch_size, args.criterion), indent=2)
+        if args.output is None:
+            print(report)
+        else:
+            with open(args.output, 'w') as f:
+                f.write(report + '\n')
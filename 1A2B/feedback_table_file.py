@@ -0,0 +1,73 @@
+"""
+Saves and loads the packed feedback table of 1A2B, and the feedback masks of 1a2b_gpu_best_strategy.py.
+
+feedback_table[guess_index, solution_index] is the feedback code A * (num_digits + 1) + B
+when guessing the `guess_index`-th number without duplicating digit,
+while the solution is the `solution_index`-th one.
+Numbers are indexed in ascending order, e.g. 0123 is the 0-th one and 0124 is the 1-st one.
+Tables of alphabets other than the 10 digits are saved beside, e.g. feedback_table_4_digits_16_symbols.npy
+feedback_masks[guess_index, slot] is the bitset of the numbers answering the slot-th possible feedback to the guess,
+saved as feedback_masks_4_digits.npy.
+Both are loaded as read-only memory maps, so that all the processes share the same pages.
+"""
+import os
+from typing import Optional
+import numpy as np
+
+default_directory = os.path.dirname(os.path.abspath(__file__))
+
+
+def path(num_digits: int, directory: str = default_directory, alphabet_size: int = 10) -> str:
+    if alphabet_size == 10:
+        return os.path.join(directory, f'feedback_table_{num_digits}_digits.npy')
+    return os.path.join(directory, f'feedback_table_{num_digits}_digits_{alphabet_size}_symbols.npy')
+
+
+def masks_path(num_digits: int, directory: str = default_directory) -> str:
+    return os.path.join(directory, f'feedback_masks_{num_digits}_digits.npy')
+
+
+def _load(path: str) -> Optional[np.ndarray]:
+    try:
+        return np.load(path, mmap_mode='r')
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def _save(path: str, array: np.ndarray):
+    # write to a temporary file first, so that other processes never load a half-written file
+    temporary_path = path + f'.{os.getpid()}.tmp'
+    with open(temporary_path, 'wb') as f:
+        np.save(f, array)
+    os.replace(temporary_path, path)
+
+
+def load(num_digits: int, num_valid_numbers: int, directory: str = default_directory,
+         alphabet_size: int = 10) -> Optional[np.ndarray]:
+    """
+    :return: read-only memory map of the saved table, or None if the table has not been saved
+    """
+    table = _load(path(num_digits, directory, alphabet_size))
+    if table is None or table.dtype != np.uint8 or table.shape != (num_valid_numbers, num_valid_numbers):
+        return None
+    return table
+
+
+def save(num_digits: int, table: np.ndarray, directory: str = default_directory, alphabet_size: int = 10):
+    _save(path(num_digits, directory, alphabet_size), np.ascontiguousarray(table, dtype=np.uint8))
+
+
+def load_masks(num_digits: int, num_valid_numbers: int, directory: str = default_directory) -> Optional[np.ndarray]:
+    """
+    :return: read-only memory map of the saved masks shaped (guesses, feedback slots, bitset words),
+        or None if the masks have not been saved
+    """
+    masks = _load(masks_path(num_digits, directory))
+    if masks is None or masks.dtype != np.uint32 or masks.ndim != 3 or \
+            masks.shape[0] != num_valid_numbers or masks.shape[2] != (num_valid_numbers + 31) // 32:
+        return None
+    return masks
+
+
+def save_masks(num_digits: int, masks: np.ndarray, directory: str = default_directory):
+    _save(masks_path(num_digits, directory), np.ascontiguousarray(masks, dtype=np.uint32))
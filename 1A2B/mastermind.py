@@ -0,0 +1,236 @@
+"""
+1A2B (Bulls and Cows) with any amount of digits and any alphabet of at most 32 symbols.
+
+Only the codes without duplicating symbol are enumerated. When the feedback table of all the pairs of codes
+does not fit in `max_table_MB`, feedbacks are computed on the fly, and the guesses are scored tile by tile,
+so that the memory grows linearly with the amount of codes.
+
+import taichi as ti
+ti.init(arch=ti.gpu)
+from mastermind import Mastermind
+game = Mastermind(num_digits=5)
+game.test(tries=100)
+"""
+import itertools
+import math
+import time
+from typing import Tuple
+import numpy as np
+import taichi as ti
+import feedback_table_file
+from scoring import EXPECTED_SIZE, ENTROPY, WORST_CASE, PARTITIONS, worst_score, print_statistics
+from scoring_kernels import popcount, add_feedback_group
+
+symbols = '0123456789abcdefghijklmnopqrstuv'
+
+
+@ti.data_oriented
+class Mastermind:
+    
+    def __init__(self, num_digits: int = 4, alphabet_size: int = 10, max_table_MB: float = 256, tile_size: int = 1024):
+        """
+        :param max_table_MB: the feedback table of all the pairs is used only if it is not larger than this
+        :param tile_size: amount of guesses scored by each kernel launch without the table
+        """
+        assert num_digits <= alphabet_size <= len(symbols)
+        self.num_digits = num_digits
+        self.alphabet_size = alphabet_size
+        self.num_codes = math.perm(alphabet_size, num_digits)
+        self.num_feedback_codes = (num_digits + 1) ** 2  # feedback code = A * (num_digits + 1) + B
+        self.feedback_codes = [a * (num_digits + 1) + b for a in range(num_digits + 1) for b in range(num_digits + 1 - a)
+                               if not (a == num_digits - 1 and b == 1)]
+        self.use_table = self.num_codes ** 2 <= max_table_MB * 2 ** 20
+        self.tile_size = min(tile_size, self.num_codes)
+        
+        # read only
+        self.codes = np.array(list(itertools.permutations(range(alphabet_size), num_digits)), dtype=np.uint8)
+        self.digits = ti.field(dtype=ti.uint8, shape=(self.num_codes, num_digits))
+        self.digits.from_numpy(self.codes)
+        self.symbol_sets = ti.field(dtype=ti.uint32, shape=self.num_codes)  # bit s is 1 if the code has symbol s
+        self.symbol_sets.from_numpy(np.bitwise_or.reduce(np.uint32(1) << self.codes.astype(np.uint32), axis=1))
+        if self.use_table:
+            self.table = ti.field(dtype=ti.uint8, shape=(self.num_codes, self.num_codes))
+            table = feedback_table_file.load(num_digits, self.num_codes, alphabet_size=alphabet_size)
+            if table is None:
+                self._compute_table()
+                feedback_table_file.save(num_digits, self.table.to_numpy(), alphabet_size=alphabet_size)
+            else:
+                self.table.from_numpy(np.ascontiguousarray(table))
+        
+        # state variables
+        self.candidates = ti.field(dtype=ti.int32, shape=self.num_codes)  # candidates[:num_candidates] in any order
+        self.next_candidates = ti.field(dtype=ti.int32, shape=self.num_codes)
+        self.num_candidates = ti.field(dtype=ti.int32, shape=())
+        self.num_next_candidates = ti.field(dtype=ti.int32, shape=())
+        self.is_candidate = ti.field(dtype=ti.uint8, shape=self.num_codes)
+        
+        # written for each tile of guesses
+        self.histogram = ti.field(dtype=ti.int32, shape=(self.tile_size, self.num_feedback_codes))
+        self.tile_scores = ti.field(dtype=ti.float32, shape=self.tile_size)
+        self.tile_best_score = ti.field(dtype=ti.float32, shape=())
+        self.tile_best_key = ti.field(dtype=ti.int32, shape=())
+        self.best_score = ti.field(dtype=ti.float32, shape=())
+        self.best_key = ti.field(dtype=ti.int32, shape=())  # guess, plus num_codes if it is not a candidate
+        self.new_game()
+    
+    def code(self, index: int) -> str:
+        return ''.join(symbols[s] for s in self.codes[index])
+    
+    def index(self, code: str) -> int:
+        digits = [symbols.index(s) for s in code]
+        # permutations are enumerated in lexicographic order
+        index = 0
+        for d, digit in enumerate(digits):
+            smaller_unused = digit - sum(previous < digit for previous in digits[:d])
+            index += smaller_unused * math.perm(self.alphabet_size - d - 1, self.num_digits - d - 1)
+        return index
+    
+    def feedback(self, guess: int, solution: int) -> Tuple[int, int]:
+        """
+        :param guess: index of the guessed code
+        :param solution: index of the solution
+        :return: (A, B)
+        """
+        A = int((self.codes[guess] == self.codes[solution]).sum())
+        return A, len(set(self.codes[guess]) & set(self.codes[solution])) - A
+    
+    @ti.func
+    def _feedback_code(self, guess, solution) -> ti.int32:
+        code = 0
+        if ti.static(self.use_table):
+            code = ti.cast(self.table[guess, solution], ti.int32)
+        else:
+            A = 0
+            for d in ti.static(range(self.num_digits)):
+                if self.digits[guess, d] == self.digits[solution, d]:
+                    A += 1
+            common = popcount(self.symbol_sets[guess] & self.symbol_sets[solution])
+            code = A * (self.num_digits + 1) + common - A
+        return code
+    
+    @ti.kernel
+    def _compute_table(self):
+        for guess, solution in self.table:
+            A = 0
+            for d in ti.static(range(self.num_digits)):
+                if self.digits[guess, d] == self.digits[solution, d]:
+                    A += 1
+            common = popcount(self.symbol_sets[guess] & self.symbol_sets[solution])
+            self.table[guess, solution] = ti.cast(A * (self.num_digits + 1) + common - A, ti.uint8)
+    
+    @ti.kernel
+    def new_game(self):
+        for i in self.candidates:
+            self.candidates[i] = i
+            self.is_candidate[i] = ti.cast(1, ti.uint8)
+        self.num_candidates[None] = self.num_codes
+    
+    @ti.func
+    def _score(self, guess_in_tile, criterion: ti.template()) -> ti.float32:
+        """
+        :return: score of the guess. The lower, the better
+        """
+        score = 0.0
+        for code in ti.static(self.feedback_codes):
+            score = add_feedback_group(score, ti.cast(self.histogram[guess_in_tile, code], ti.float32), criterion)
+        return score
+    
+    @ti.kernel
+    def _reset_best(self):
+        self.best_score[None] = worst_score
+        self.best_key[None] = 2 ** 31 - 1
+    
+    @ti.kernel
+    def _score_tile(self, tile_start: ti.int32, criterion: ti.template()):
+        """
+        Scores the guesses tile_start, ..., tile_start + tile_size - 1, and merges the best one into best_key[None]
+        """
+        for guess_in_tile, code in self.histogram:
+            self.histogram[guess_in_tile, code] = 0
+        for guess_in_tile, k in ti.ndrange(self.tile_size, self.num_candidates[None]):
+            if tile_start + guess_in_tile < self.num_codes:
+                self.histogram[guess_in_tile, self._feedback_code(tile_start + guess_in_tile, self.candidates[k])] += 1
+        self.tile_best_score[None] = worst_score
+        self.tile_best_key[None] = 2 ** 31 - 1
+        for guess_in_tile in self.tile_scores:
+            if tile_start + guess_in_tile < self.num_codes:
+                self.tile_scores[guess_in_tile] = self._score(guess_in_tile, criterion)
+                ti.atomic_min(self.tile_best_score[None], self.tile_scores[guess_in_tile])
+        for guess_in_tile in self.tile_scores:
+            guess = tile_start + guess_in_tile
+            if guess < self.num_codes and self.tile_scores[guess_in_tile] == self.tile_best_score[None]:
+                ti.atomic_min(self.tile_best_key[None], guess + (1 - ti.cast(self.is_candidate[guess], ti.int32)) * self.num_codes)
+        if self.tile_best_score[None] < self.best_score[None] or (
+                self.tile_best_score[None] == self.best_score[None] and self.tile_best_key[None] < self.best_key[None]):
+            self.best_score[None] = self.tile_best_score[None]
+            self.best_key[None] = self.tile_best_key[None]
+    
+    def suggest(self, criterion: int = EXPECTED_SIZE) -> int:
+        """
+        :return: index of the best guess.
+            Among the guesses with the best score, a candidate is preferred, and then the smallest index
+        """
+        if self.num_candidates[None] == self.num_codes:
+            # all the codes are the same before the first guess
+            return 0
+        self._reset_best()
+        for tile_start in range(0, self.num_codes, self.tile_size):
+            self._score_tile(tile_start, criterion)
+        return self.best_key[None] % self.num_codes
+    
+    @ti.kernel
+    def reduce(self, guess: ti.int32, A: ti.int32, B: ti.int32) -> ti.int32:
+        """
+        Keeps the candidates answering `A`A`B`B to `guess`, except the guess itself
+        :return: amount of the remaining candidates
+        """
+        self.num_next_candidates[None] = 0
+        for k in range(self.num_candidates[None]):
+            candidate = self.candidates[k]
+            if candidate != guess and self._feedback_code(guess, candidate) == A * (self.num_digits + 1) + B:
+                self.next_candidates[ti.atomic_add(self.num_next_candidates[None], 1)] = candidate
+            else:
+                self.is_candidate[candidate] = ti.cast(0, ti.uint8)
+        self.num_candidates[None] = self.num_next_candidates[None]
+        for k in range(self.num_candidates[None]):
+            self.candidates[k] = self.next_candidates[k]
+        return self.num_candidates[None]
+    
+    def play(self, solution: int, criterion: int = EXPECTED_SIZE) -> int:
+        """
+        :param solution: index of the solution
+        :return: amount of guesses to find the solution
+        """
+        self.new_game()
+        guesses = 0
+        while self.num_candidates[None] > 0:
+            guess = self.suggest(criterion)
+            guesses += 1
+            self.reduce(guess, *self.feedback(guess, solution))
+        return guesses
+    
+    def play_once(self, criterion: int = EXPECTED_SIZE):
+        self.new_game()
+        while self.num_candidates[None] > 0:
+            guess = self.suggest(criterion)
+            print(self.num_candidates[None])
+            print(self.code(guess), end='\t')
+            A, B = map(int, input().split())
+            self.reduce(guess, A, B)
+    
+    def test(self, tries: int = 100, seed: int = 0, criterion: int = EXPECTED_SIZE):
+        print(f'You are testing {self.num_digits} digits of {self.alphabet_size} symbols '
+              f'with {"the feedback table" if self.use_table else "feedbacks computed on the fly"}')
+        rng = np.random.default_rng(seed)
+        guess_counts = np.zeros(tries, dtype=np.int32)
+        start_time = time.time()
+        for i in range(tries):
+            guess_counts[i] = self.play(int(rng.integers(self.num_codes)), criterion)
+        end_time = time.time()
+        print(f'time cost: {end_time - start_time} seconds with {tries} tries')
+        print_statistics(guess_counts)
+
+
+if __name__ == '__main__':
+    ti.init(arch=ti.gpu, offline_cache=True)
+    Mastermind(num_digits=5).test(tries=100)
@@ -0,0 +1,168 @@
+"""
+The same game and API as mastermind.py, with NumPy array operations instead of taichi kernels.
+
+It does not need taichi or any JIT compilation, so it starts at once, and it is fast enough for small games,
+e.g. the 5040 codes of 4 digits, whose feedback table fits in the CPU cache.
+Feedbacks are computed by broadcast comparisons of the digits and popcounts of the symbol sets,
+and the guesses are scored tile by tile with `np.bincount` histograms.
+
+from mastermind_numpy import Mastermind  # instead of `from mastermind import Mastermind`
+game = Mastermind(num_digits=4)
+game.test(tries=100)
+"""
+import itertools
+import math
+import time
+from typing import Tuple
+import numpy as np
+import feedback_table_file
+from scoring import EXPECTED_SIZE, ENTROPY, WORST_CASE, PARTITIONS, popcount, score_histograms, print_statistics
+
+symbols = '0123456789abcdefghijklmnopqrstuv'
+
+
+class Mastermind:
+
+    def __init__(self, num_digits: int = 4, alphabet_size: int = 10, max_table_MB: float = 256, tile_size: int = 1024):
+        """
+        :param max_table_MB: the feedback table of all the pairs is used only if it is not larger than this
+        :param tile_size: amount of guesses scored at once without the table
+        """
+        assert num_digits <= alphabet_size <= len(symbols)
+        self.num_digits = num_digits
+        self.alphabet_size = alphabet_size
+        self.num_codes = math.perm(alphabet_size, num_digits)
+        self.num_feedback_codes = (num_digits + 1) ** 2  # feedback code = A * (num_digits + 1) + B
+        self.feedback_codes = [a * (num_digits + 1) + b for a in range(num_digits + 1) for b in range(num_digits + 1 - a)
+                               if not (a == num_digits - 1 and b == 1)]
+        self.use_table = self.num_codes ** 2 <= max_table_MB * 2 ** 20
+        self.tile_size = min(tile_size, self.num_codes)
+
+        # read only
+        self.codes = np.array(list(itertools.permutations(range(alphabet_size), num_digits)), dtype=np.uint8)
+        self.symbol_sets = np.bitwise_or.reduce(np.uint32(1) << self.codes.astype(np.uint32), axis=1)
+        if self.use_table:
+            table = feedback_table_file.load(num_digits, self.num_codes, alphabet_size=alphabet_size)
+            if table is None:
+                table = np.empty((self.num_codes, self.num_codes), dtype=np.uint8)
+                for tile_start in range(0, self.num_codes, self.tile_size):
+                    guesses = np.arange(tile_start, min(tile_start + self.tile_size, self.num_codes))
+                    table[guesses] = self._compute_feedback_codes(guesses, np.arange(self.num_codes))
+                feedback_table_file.save(num_digits, table, alphabet_size=alphabet_size)
+            self.table = table
+
+        # state variables
+        self.candidates = np.arange(self.num_codes)  # in ascending order
+        self.is_candidate = np.ones(self.num_codes, dtype=bool)
+        self.num_candidates = self.num_codes
+        self.new_game()
+
+    def code(self, index: int) -> str:
+        return ''.join(symbols[s] for s in self.codes[index])
+
+    def index(self, code: str) -> int:
+        digits = [symbols.index(s) for s in code]
+        # permutations are enumerated in lexicographic order
+        index = 0
+        for d, digit in enumerate(digits):
+            smaller_unused = digit - sum(previous < digit for previous in digits[:d])
+            index += smaller_unused * math.perm(self.alphabet_size - d - 1, self.num_digits - d - 1)
+        return index
+
+    def feedback(self, guess: int, solution: int) -> Tuple[int, int]:
+        """
+        :param guess: index of the guessed code
+        :param solution: index of the solution
+        :return: (A, B)
+        """
+        A = int((self.codes[guess] == self.codes[solution]).sum())
+        return A, len(set(self.codes[guess]) & set(self.codes[solution])) - A
+
+    def _compute_feedback_codes(self, guesses: np.ndarray, solutions: np.ndarray) -> np.ndarray:
+        """
+        :return: feedback code of each pair of the guesses and the solutions, shaped (guesses, solutions)
+        """
+        A = np.zeros((guesses.shape[0], solutions.shape[0]), dtype=np.int32)
+        for d in range(self.num_digits):
+            A += self.codes[guesses, d][:, None] == self.codes[solutions, d][None, :]
+        common = popcount(self.symbol_sets[guesses][:, None] & self.symbol_sets[solutions][None, :])
+        return (A * (self.num_digits + 1) + common - A).astype(np.uint8)
+
+    def _feedback_codes(self, guesses: np.ndarray, solutions: np.ndarray) -> np.ndarray:
+        if self.use_table:
+            return self.table[guesses[:, None], solutions[None, :]]
+        return self._compute_feedback_codes(guesses, solutions)
+
+    def new_game(self):
+        self.candidates = np.arange(self.num_codes)
+        self.is_candidate[:] = True
+        self.num_candidates = self.num_codes
+
+    def suggest(self, criterion: int = EXPECTED_SIZE) -> int:
+        """
+        :return: index of the best guess.
+            Among the guesses with the best score, a candidate is preferred, and then the smallest index
+        """
+        if self.num_candidates == self.num_codes:
+            # all the codes are the same before the first guess
+            return 0
+        scores = np.empty(self.num_codes, dtype=np.float32)
+        for tile_start in range(0, self.num_codes, self.tile_size):
+            guesses = np.arange(tile_start, min(tile_start + self.tile_size, self.num_codes))
+            codes = self._feedback_codes(guesses, self.candidates).astype(np.int64)
+            codes += np.arange(guesses.shape[0])[:, None] * self.num_feedback_codes
+            histogram = np.bincount(codes.ravel(), minlength=guesses.shape[0] * self.num_feedback_codes)
+            scores[guesses] = score_histograms(histogram.reshape(guesses.shape[0], self.num_feedback_codes), criterion)
+        best = np.flatnonzero(scores == scores.min())
+        best_candidates = best[self.is_candidate[best]]
+        return int(best_candidates[0] if best_candidates.shape[0] > 0 else best[0])
+
+    def reduce(self, guess: int, A: int, B: int) -> int:
+        """
+        Keeps the candidates answering `A`A`B`B to `guess`, except the guess itself
+        :return: amount of the remaining candidates
+        """
+        codes = self._feedback_codes(np.array([guess]), self.candidates)[0]
+        keep = (codes == A * (self.num_digits + 1) + B) & (self.candidates != guess)
+        self.is_candidate[self.candidates[~keep]] = False
+        self.candidates = self.candidates[keep]
+        self.num_candidates = self.candidates.shape[0]
+        return self.num_candidates
+
+    def play(self, solution: int, criterion: int = EXPECTED_SIZE) -> int:
+        """
+        :param solution: index of the solution
+        :return: amount of guesses to find the solution
+        """
+        self.new_game()
+        guesses = 0
+        while self.num_candidates > 0:
+            guess = self.suggest(criterion)
+            guesses += 1
+            self.reduce(guess, *self.feedback(guess, solution))
+        return guesses
+
+    def play_once(self, criterion: int = EXPECTED_SIZE):
+        self.new_game()
+        while self.num_candidates > 0:
+            guess = self.suggest(criterion)
+            print(self.num_candidates)
+            print(self.code(guess), end='\t')
+            A, B = map(int, input().split())
+            self.reduce(guess, A, B)
+
+    def test(self, tries: int = 100, seed: int = 0, criterion: int = EXPECTED_SIZE):
+        print(f'You are testing {self.num_digits} digits of {self.alphabet_size} symbols with NumPy '
+              f'and {"the feedback table" if self.use_table else "feedbacks computed on the fly"}')
+        rng = np.random.default_rng(seed)
+        guess_counts = np.zeros(tries, dtype=np.int32)
+        start_time = time.time()
+        for i in range(tries):
+            guess_counts[i] = self.play(int(rng.integers(self.num_codes)), criterion)
+        end_time = time.time()
+        print(f'time cost: {end_time - start_time} seconds with {tries} tries')
+        print_statistics(guess_counts)
+
+
+if __name__ == '__main__':
+    Mastermind(num_digits=4).test(tries=100)
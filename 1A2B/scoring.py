@@ -0,0 +1,47 @@
+"""
+Criteria to score a guess, and statistics of the simulated games, shared by all the strategies of 1A2B.
+
+It needs only numpy. The same criteria for taichi kernels are in scoring_kernels.py.
+"""
+import numpy as np
+
+# criteria to score a guess with the sizes of the groups of candidates sharing a feedback
+EXPECTED_SIZE = 0  # expected amount of remaining candidates
+ENTROPY = 1  # expected amount of information
+WORST_CASE = 2  # largest amount of remaining candidates
+PARTITIONS = 3  # amount of different feedbacks
+worst_score = 1e30
+
+
+def popcount(x: np.ndarray) -> np.ndarray:
+    x = x - ((x >> np.uint32(1)) & np.uint32(0x55555555))
+    x = (x & np.uint32(0x33333333)) + ((x >> np.uint32(2)) & np.uint32(0x33333333))
+    x = (x + (x >> np.uint32(4))) & np.uint32(0x0f0f0f0f)
+    return ((x * np.uint32(0x01010101)) >> np.uint32(24)).astype(np.int32)
+
+
+def score_histograms(histogram: np.ndarray, criterion: int) -> np.ndarray:
+    """
+    :param histogram: amount of candidates answering each feedback code to each guess, shaped (guesses, codes)
+    :return: score of each guess, in float32 like the kernels. The lower, the better
+    """
+    n = histogram.astype(np.float32)
+    if criterion == EXPECTED_SIZE:
+        # proportional to the expected amount of remaining candidates
+        return (n * n).sum(axis=1)
+    if criterion == ENTROPY:
+        # the expected amount of information is log(total) - score / total
+        return (n * np.log(np.maximum(n, np.float32(1)))).sum(axis=1)
+    if criterion == WORST_CASE:
+        return n.max(axis=1)
+    return -(n > 0).sum(axis=1).astype(np.float32)
+
+
+def print_statistics(guess_counts: np.ndarray):
+    """
+    :param guess_counts: amount of guesses to finish each game
+    """
+    print(f'min: {guess_counts.min()}, avg: {guess_counts.mean()}, max: {guess_counts.max()}')
+    for guesses, games_count in enumerate(np.bincount(guess_counts)):
+        if games_count > 0:
+            print(f'{guesses} guesses: {games_count} games')
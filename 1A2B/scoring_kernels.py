@@ -0,0 +1,39 @@
+"""
+The criteria of scoring.py, and bit operations, for taichi kernels.
+
+Importing it does not initialize taichi.
+"""
+import taichi as ti
+from scoring import EXPECTED_SIZE, ENTROPY, WORST_CASE
+
+
+@ti.func
+def popcount(x: ti.uint32) -> ti.int32:
+    x = x - ((x >> 1) & ti.cast(0x55555555, ti.uint32))
+    x = (x & ti.cast(0x33333333, ti.uint32)) + ((x >> 2) & ti.cast(0x33333333, ti.uint32))
+    x = (x + (x >> 4)) & ti.cast(0x0f0f0f0f, ti.uint32)
+    return ti.cast((x * ti.cast(0x01010101, ti.uint32)) >> 24, ti.int32)
+
+
+@ti.func
+def add_feedback_group(score, n, criterion: ti.template()) -> ti.float32:
+    """
+    Scores a guess one feedback at a time, starting from a score of 0
+    :param score: score of the groups of candidates so far
+    :param n: amount of candidates answering the next feedback to the guess, as float32
+    :param criterion: EXPECTED_SIZE, ENTROPY, WORST_CASE or PARTITIONS
+    :return: score of the groups so far and this group. The lower, the better
+    """
+    if ti.static(criterion == EXPECTED_SIZE):
+        # proportional to the expected amount of remaining candidates
+        score += n * n
+    elif ti.static(criterion == ENTROPY):
+        # the expected amount of information is log(total) - score / total
+        if n > 0:
+            score += n * ti.log(n)
+    elif ti.static(criterion == WORST_CASE):
+        score = ti.max(score, n)
+    else:
+        if n > 0:
+            score -= 1.0
+    return score
@@ -0,0 +1,93 @@
+"""
+Simulates 1a2b_gpu_best_strategy.py with a pool of processes on the CPU.
+
+Each process has its own taichi runtime on the CPU, and plays its shards of games with `BatchedGames`.
+The feedback table and masks are computed at most once, and then memory-mapped read-only by every process
+from the saved files, and passed to the kernels without copying, so that all the processes share the same pages.
+Games are split into shards of a fixed size, and the solutions of each shard are generated from (seed, shard),
+so that the merged report depends only on the seed, no matter how many processes are used.
+"""
+import importlib
+import math
+import multiprocessing
+import os
+import platform
+import time
+from typing import Tuple
+import numpy as np
+import feedback_table_file
+from scoring import EXPECTED_SIZE, print_statistics
+
+num_digits = 4
+shard_size = 250
+
+strategy = None
+games = None
+
+
+def cpu_arch_name() -> str:
+    return 'arm64' if platform.machine().lower() in ('arm64', 'aarch64') else 'x64'
+
+
+def _initialize_worker(num_threads: int, criterion: int):
+    global strategy, games
+    os.environ['TI_ARCH'] = cpu_arch_name()
+    os.environ['TI_CPU_MAX_NUM_THREADS'] = str(num_threads)
+    strategy = importlib.import_module('1a2b_gpu_best_strategy')
+    # maps the feedback table and masks saved by `prepare_feedback_table`, or computes and saves them
+    games = strategy.BatchedGames(shard_size, criterion)
+
+
+def _simulate_shard(shard: Tuple[int, int, int]) -> Tuple[int, np.ndarray]:
+    """
+    :param shard: (seed, index of the shard, amount of games)
+    :return: the amount of games, and the amount of games finished with each amount of guesses
+    """
+    seed, shard_index, tries = shard
+    rng = np.random.default_rng([seed, shard_index])
+    secrets = rng.integers(strategy.num_valid_numbers, size=tries, dtype=np.int32)
+    return tries, np.bincount(games.play(secrets))
+
+
+def prepare_feedback_table(context: multiprocessing.context.BaseContext, criterion: int):
+    num_valid_numbers = math.perm(10, num_digits)
+    if feedback_table_file.load(num_digits, num_valid_numbers) is not None and \
+            feedback_table_file.load_masks(num_digits, num_valid_numbers) is not None:
+        return
+    with context.Pool(1, initializer=_initialize_worker, initargs=(os.cpu_count(), criterion)) as pool:
+        pool.apply(int)
+
+
+def simulate(tries: int = 10000, processes: int = None, seed: int = 0, criterion: int = EXPECTED_SIZE) -> np.ndarray:
+    """
+    :param processes: amount of processes, default to the amount of CPU cores
+    :param criterion: one of the criteria of scoring.py
+    :return: the amount of games finished with each amount of guesses
+    """
+    if processes is None:
+        processes = os.cpu_count()
+    print(f'You are simulating with {processes} processes')
+    # taichi runtimes must not be forked
+    context = multiprocessing.get_context('spawn')
+    prepare_feedback_table(context, criterion)
+    start_time = time.time()
+    shards = [(seed, shard, min(shard_size, tries - first_game))
+              for shard, first_game in enumerate(range(0, tries, shard_size))]
+    histogram = np.zeros(1, dtype=np.int64)
+    finished = 0
+    with context.Pool(processes, initializer=_initialize_worker,
+                      initargs=(max(1, os.cpu_count() // processes), criterion)) as pool:
+        for shard_tries, shard_histogram in pool.imap_unordered(_simulate_shard, shards):
+            if shard_histogram.shape[0] > histogram.shape[0]:
+                histogram = np.pad(histogram, (0, shard_histogram.shape[0] - histogram.shape[0]))
+            histogram[:shard_histogram.shape[0]] += shard_histogram
+            finished += shard_tries
+            print(f"Finished {finished} games")
+    end_time = time.time()
+    print(f'time cost: {end_time - start_time} seconds with {finished} tries')
+    print_statistics(np.repeat(np.arange(histogram.shape[0]), histogram))
+    return histogram
+
+
+if __name__ == '__main__':
+    simulate()
@@ -0,0 +1,110 @@
+"""
+Precomputed strategy tree ("opening book") of 1A2B.
+
+The tree is built once by `build_strategy_book()` in 1a2b_gpu_best_strategy.py.
+Playing with the book needs only numpy: each turn is a lookup of the next node by the feedback,
+so that IntelligentIthea can answer without starting taichi.
+"""
+import os
+import random
+import time
+from typing import Optional, Tuple
+import numpy as np
+from scoring import print_statistics
+
+default_directory = os.path.dirname(os.path.abspath(__file__))
+
+
+def path(num_digits: int, criterion: int, directory: str = default_directory) -> str:
+    return os.path.join(directory, f'strategy_book_{num_digits}_digits_criterion_{criterion}.npz')
+
+
+class StrategyBook:
+    root = 0
+    
+    def __init__(self, num_digits: int, guesses: np.ndarray, children: np.ndarray):
+        """
+        :param guesses: guesses[node] is the number to guess at the node
+        :param children: children[node, A * (num_digits + 1) + B] is the node after the feedback,
+            or -1 if the game is won or the feedback is impossible
+        """
+        self.num_digits = num_digits
+        self.guesses = guesses
+        self.children = children
+    
+    def __len__(self):
+        return self.guesses.shape[0]
+    
+    def guess(self, node: int) -> int:
+        return int(self.guesses[node])
+    
+    def next(self, node: int, A: int, B: int) -> int:
+        return int(self.children[node, A * (self.num_digits + 1) + B])
+
+
+def save(book: StrategyBook, path: str):
+    # write to a temporary file first, so that other processes never load a half-written book
+    temporary_path = path + f'.{os.getpid()}.tmp'
+    with open(temporary_path, 'wb') as f:
+        np.savez_compressed(f, num_digits=book.num_digits, guesses=book.guesses, children=book.children)
+    os.replace(temporary_path, path)
+
+
+def load(path: str) -> Optional[StrategyBook]:
+    """
+    :return: the saved book, or None if the book has not been built
+    """
+    try:
+        with np.load(path) as f:
+            return StrategyBook(int(f['num_digits']), f['guesses'], f['children'])
+    except FileNotFoundError:
+        return None
+
+
+def feedback(solution: int, guess: int, num_digits: int) -> Tuple[int, int]:
+    """
+    :param solution: 8317
+    :param guess: 2708
+    :return: (0, 2) for 0A2B
+    """
+    solution_digits, guess_digits = str(solution).zfill(num_digits), str(guess).zfill(num_digits)
+    A = sum(s == g for s, g in zip(solution_digits, guess_digits))
+    return A, len(set(solution_digits) & set(guess_digits)) - A
+
+
+def play_once(book: StrategyBook):
+    node = book.root
+    while node >= 0:
+        print(str(book.guess(node)).zfill(book.num_digits), end='\t')
+        A, B = map(int, input().split())
+        if A == book.num_digits:
+            return
+        node = book.next(node, A, B)
+    print('No number matches all the feedbacks')
+
+
+def test(book: StrategyBook, tries: int = 10000):
+    print('You are testing the performance of the strategy book')
+    start_time = time.time()
+    guess_counts = np.zeros(tries, dtype=np.int32)
+    for i in range(tries):
+        solution = int(''.join(random.sample('0123456789', book.num_digits)))
+        node = book.root
+        while True:
+            guess_counts[i] += 1
+            A, B = feedback(solution, book.guess(node), book.num_digits)
+            if A == book.num_digits:
+                break
+            node = book.next(node, A, B)
+    end_time = time.time()
+    print(f'time cost: {end_time - start_time} seconds with {tries} tries')
+    print_statistics(guess_counts)
+
+
+if __name__ == '__main__':
+    book = load(path(4, 0))
+    if book is None:
+        print('Call build_strategy_book() in 1a2b_gpu_best_strategy.py to build the book first')
+    else:
+        # play_once(book)
+        test(book)
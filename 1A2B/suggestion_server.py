@@ -0,0 +1,281 @@
+"""
+Serves the best guesses of 1a2b_gpu_best_strategy.py to many concurrent players.
+
+Each connection sends one JSON object per line, and gets one JSON object per line back:
+
+{"op": "new"}                                    -> {"session": 0, "guess": "0123"}
+{"op": "feedback", "session": 0, "A": 0, "B": 2} -> {"session": 0, "guess": "1045", "guesses": 1, "candidates": 1260}
+{"op": "feedback", "session": 0, "A": 4, "B": 0} -> {"session": 0, "guess": null, "guesses": 5, "candidates": 0}
+{"op": "close", "session": 0}                    -> {"session": 0}
+{"op": "stats"}                                  -> {"sessions": 0, "latency_p50_ms": ..., ...}
+
+The sessions which are not closed are removed when their connection is closed.
+
+The candidates of each session are kept on the host as a bitset, and filtered with the saved feedback table.
+Suggestions requested by different sessions within `batch_window_ms` are scored together by one launch of
+`BatchedGames.find_best_guesses`, and the suggestions of recently seen sets of candidates are cached.
+
+python suggestion_server.py --port 7040
+python suggestion_server.py --load-test 2000 --concurrency 200
+"""
+import argparse
+import asyncio
+import collections
+import concurrent.futures
+import importlib
+import itertools
+import json
+import time
+from typing import Any, Dict, List, Optional, Tuple
+import numpy as np
+import feedback_table_file
+import strategy_book
+
+strategy = importlib.import_module('1a2b_gpu_best_strategy')
+
+
+def pack_candidates(is_candidate: np.ndarray) -> np.ndarray:
+    """
+    :param is_candidate: bool of each valid number
+    :return: bitset in the layout of `candidate_bits`
+    """
+    padded = np.zeros(strategy.num_bitset_words * 32, dtype=bool)
+    padded[:is_candidate.shape[0]] = is_candidate
+    return np.packbits(padded, bitorder='little').view('<u4').astype(np.uint32)
+
+
+class Session:
+
+    def __init__(self, candidate_bits: np.ndarray):
+        self.candidate_bits = candidate_bits
+        self.guess = -1  # index of the last suggested guess
+        self.guess_count = 0
+
+
+class SuggestionService:
+
+    def __init__(self, criterion: int = strategy.EXPECTED_SIZE, batch_size: int = 256,
+                 batch_window_seconds: float = 0.002, cache_size: int = 4096):
+        self.games = strategy.BatchedGames(batch_size, criterion)
+        self.batch_size = batch_size
+        self.batch_window_seconds = batch_window_seconds
+        table = feedback_table_file.load(strategy.num_digits, strategy.num_valid_numbers)
+        self.feedback_table = strategy.feedback_table_numpy() if table is None else table
+        self.valid_numbers = strategy.valid_numbers.to_numpy()
+        self.all_candidate_bits = pack_candidates(np.ones(strategy.num_valid_numbers, dtype=bool))
+        # taichi is only called from this thread, one batch at a time
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        self.sessions: Dict[int, Session] = {}
+        self.session_ids = itertools.count()
+        self.pending: List[Tuple[np.ndarray, asyncio.Future]] = []
+        self.flush_handle: Optional[asyncio.TimerHandle] = None
+        self.cache: collections.OrderedDict = collections.OrderedDict()  # candidate_bits.tobytes() -> guess index
+        self.cache_size = cache_size
+        # the first launch includes the JIT compilation, which must not be counted in the latencies.
+        # Its result, the opening guess, is the first suggestion of every session
+        self.cache[self.all_candidate_bits.tobytes()] = int(self.games.suggest(self.all_candidate_bits[None])[0])
+        # statistics
+        self.start_time = time.perf_counter()
+        self.latencies = collections.deque(maxlen=10000)
+        self.finished_sessions = 0
+        self.batches = 0
+        self.batched_suggestions = 0
+        self.cache_hits = 0
+
+    def format(self, guess: int) -> Optional[str]:
+        if guess < 0:
+            return None
+        return f'{self.valid_numbers[guess]:0{strategy.num_digits}d}'
+
+    async def suggest(self, candidate_bits: np.ndarray) -> int:
+        """
+        :return: index of the best guess for the candidates, or -1 if there is no candidate
+        """
+        start_time = time.perf_counter()
+        key = candidate_bits.tobytes()
+        if key in self.cache:
+            self.cache.move_to_end(key)
+            self.cache_hits += 1
+            guess = self.cache[key]
+        else:
+            future = asyncio.get_running_loop().create_future()
+            self.pending.append((candidate_bits, future))
+            if len(self.pending) >= self.batch_size:
+                self._flush()
+            elif self.flush_handle is None:
+                self.flush_handle = asyncio.get_running_loop().call_later(self.batch_window_seconds, self._flush)
+            guess = await future
+            self.cache[key] = guess
+            if len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        self.latencies.append(time.perf_counter() - start_time)
+        return guess
+
+    def _flush(self):
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+        while self.pending:
+            batch, self.pending = self.pending[:self.batch_size], self.pending[self.batch_size:]
+            self.batches += 1
+            self.batched_suggestions += len(batch)
+            asyncio.ensure_future(self._score_batch(batch))
+
+    async def _score_batch(self, batch: List[Tuple[np.ndarray, asyncio.Future]]):
+        candidate_bits = np.stack([bits for bits, _ in batch])
+        try:
+            guesses = await asyncio.get_running_loop().run_in_executor(
+                self.executor, self.games.suggest, candidate_bits)
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        for (_, future), guess in zip(batch, guesses):
+            future.set_result(int(guess))
+
+    async def new_session(self) -> Dict[str, Any]:
+        session_id = next(self.session_ids)
+        session = Session(self.all_candidate_bits)
+        self.sessions[session_id] = session
+        session.guess = await self.suggest(session.candidate_bits)
+        return {'session': session_id, 'guess': self.format(session.guess)}
+
+    async def feedback(self, session_id: int, A: int, B: int) -> Dict[str, Any]:
+        session = self.sessions[session_id]
+        if session.guess < 0:
+            raise ValueError('the game is over')
+        session.guess_count += 1
+        if A == strategy.num_digits:
+            session.candidate_bits = np.zeros_like(session.candidate_bits)
+        else:
+            code = A * (strategy.num_digits + 1) + B
+            session.candidate_bits = session.candidate_bits & pack_candidates(self.feedback_table[session.guess] == code)
+        session.guess = await self.suggest(session.candidate_bits)
+        if session.guess < 0:
+            self.finished_sessions += 1
+        return {'session': session_id, 'guess': self.format(session.guess), 'guesses': session.guess_count,
+                'candidates': int(np.unpackbits(session.candidate_bits.view(np.uint8)).sum())}
+
+    def close(self, session_id: int) -> Dict[str, Any]:
+        del self.sessions[session_id]
+        return {'session': session_id}
+
+    def stats(self) -> Dict[str, Any]:
+        latencies = np.array(self.latencies) * 1000 if self.latencies else np.zeros(1)
+        return {
+            'sessions': len(self.sessions),
+            'finished_sessions': self.finished_sessions,
+            'sessions_per_second': self.finished_sessions / (time.perf_counter() - self.start_time),
+            'latency_p50_ms': float(np.percentile(latencies, 50)),
+            'latency_p99_ms': float(np.percentile(latencies, 99)),
+            'batches': self.batches,
+            'mean_batch_size': self.batched_suggestions / self.batches if self.batches else 0.0,
+            'cache_hits': self.cache_hits,
+        }
+
+    async def handle(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        op = request.get('op')
+        if op == 'new':
+            return await self.new_session()
+        if op == 'feedback':
+            return await self.feedback(int(request['session']), int(request['A']), int(request['B']))
+        if op == 'close':
+            return self.close(int(request['session']))
+        if op == 'stats':
+            return self.stats()
+        raise ValueError(f'unknown op {op!r}')
+
+    async def serve_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        # the sessions opened through this connection, which are abandoned when the client disconnects
+        session_ids = set()
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    request = json.loads(line)
+                    response = await self.handle(request)
+                    if request.get('op') == 'new':
+                        session_ids.add(response['session'])
+                    elif request.get('op') == 'close':
+                        session_ids.discard(response['session'])
+                except (KeyError, ValueError, TypeError) as e:
+                    response = {'error': f'{type(e).__name__}: {e}'}
+                writer.write(json.dumps(response).encode() + b'\n')
+                await writer.drain()
+        finally:
+            for session_id in session_ids:
+                self.sessions.pop(session_id, None)
+            writer.close()
+
+
+async def request(reader: asyncio.StreamReader, writer: asyncio.StreamWriter, **message) -> Dict[str, Any]:
+    writer.write(json.dumps(message).encode() + b'\n')
+    await writer.drain()
+    return json.loads(await reader.readline())
+
+
+async def play_games(host: str, port: int, solutions: List[int]) -> List[int]:
+    """
+    Plays against the server through one connection
+    :return: guess count of each game
+    """
+    reader, writer = await asyncio.open_connection(host, port)
+    guess_counts = []
+    for solution in solutions:
+        response = await request(reader, writer, op='new')
+        session_id, guess_count = response['session'], 0
+        while response['guess'] is not None:
+            guess_count += 1
+            A, B = strategy_book.feedback(solution, int(response['guess']), strategy.num_digits)
+            response = await request(reader, writer, op='feedback', session=session_id, A=A, B=B)
+        await request(reader, writer, op='close', session=session_id)
+        guess_counts.append(guess_count)
+    writer.close()
+    return guess_counts
+
+
+async def load_test(service: SuggestionService, games: int, concurrency: int, seed: int = 0,
+                    host: str = '127.0.0.1', port: int = 0) -> Dict[str, Any]:
+    """
+    Plays `games` random games through `concurrency` connections to a server of `service`
+    """
+    server = await asyncio.start_server(service.serve_connection, host, port)
+    port = server.sockets[0].getsockname()[1]
+    rng = np.random.default_rng(seed)
+    solutions = [int(n) for n in service.valid_numbers[rng.integers(strategy.num_valid_numbers, size=games)]]
+    start_time = time.perf_counter()
+    results = await asyncio.gather(*[play_games(host, port, solutions[i::concurrency]) for i in range(concurrency)])
+    elapsed = time.perf_counter() - start_time
+    server.close()
+    await server.wait_closed()
+    guess_counts = np.concatenate(results)
+    return dict(service.stats(), games=games, concurrency=concurrency, seconds=elapsed,
+                games_per_second=games / elapsed, average_guesses=float(guess_counts.mean()),
+                max_guesses=int(guess_counts.max()))
+
+
+async def serve(service: SuggestionService, host: str, port: int):
+    server = await asyncio.start_server(service.serve_connection, host, port)
+    print(f'Serving on {host}:{server.sockets[0].getsockname()[1]}')
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=7040)
+    parser.add_argument('--criterion', type=int, default=strategy.EXPECTED_SIZE)
+    parser.add_argument('--batch-size', type=int, default=256, help='suggestions scored by one kernel launch')
+    parser.add_argument('--batch-window-ms', type=float, default=2.0, help='time to wait for more suggestions')
+    parser.add_argument('--cache-size', type=int, default=4096)
+    parser.add_argument('--load-test', type=int, metavar='GAMES', help='play GAMES games against an in-process server')
+    parser.add_argument('--concurrency', type=int, default=100, help='connections of the load test')
+    args = parser.parse_args()
+    service = SuggestionService(args.criterion, args.batch_size, args.batch_window_ms / 1000, args.cache_size)
+    if args.load_test is not None:
+        print(json.dumps(asyncio.run(load_test(service, args.load_test, args.concurrency)), indent=2))
+    else:
+        asyncio.run(serve(service, args.host, args.port))
@@ -1,7 +1,10 @@
 # references:
 # https://blog.boot.dev/cryptography/how-sha-2-works-step-by-step-sha-256/
 # https://github.com/keanemind/python-sha-256/blob/master/sha256.py
-from typing import Union
+import os
+import threading
+from typing import Dict, List, Tuple, Union
+import numpy as np
 import taichi as ti
 
 ti.init(arch=ti.gpu)
@@ -19,160 +22,723 @@ for i, k in enumerate([
     0x748f82ee, 0x78a5636f, 0x84c87814, 0x8cc70208, 0x90befffa, 0xa4506ceb, 0xbef9a3f7, 0xc67178f2
 ]):
     K[i] = k
+H0 = ti.field(dtype=ti.uint32, shape=8)  # initial hash values
+for i, h_ in enumerate([0x6a09e667, 0xbb67ae85, 0x3c6ef372, 0xa54ff53a, 0x510e527f, 0x9b05688c, 0x1f83d9ab, 0x5be0cd19, ]):
+    H0[i] = h_
+
+
+@ti.func
+def rotate_right(num: ti.uint32, shift: ti.template()) -> ti.uint32:
+    return (num >> shift) | (num << (32 - shift))
+
+
+@ti.func
+def big_endian(word: ti.uint32) -> ti.uint32:
+    """
+    :param word: 4 bytes read in the native little-endian order
+    :return: the same 4 bytes read in the big-endian order
+    """
+    return (word >> 24) | ((word >> 8) & ti.cast(0xff00, ti.uint32)) | ((word << 8) & ti.cast(0xff0000, ti.uint32)) | (word << 24)
+
+
+@ti.func
+def initial_state():
+    return ti.Vector([H0[i] for i in ti.static(range(8))], dt=ti.uint32)
+
+
+@ti.func
+def _round(v, kw):
+    """
+    :param v: the working variables a, b, c, d, e, f, g, h
+    :param kw: K[t] + w[t]
+    :return: the working variables after round t
+    """
+    temp1 = v[7] + (rotate_right(v[4], 6) ^ rotate_right(v[4], 11) ^ rotate_right(v[4], 25)) + ((v[4] & v[5]) ^ (~v[4] & v[6])) + kw
+    temp2 = (rotate_right(v[0], 2) ^ rotate_right(v[0], 13) ^ rotate_right(v[0], 22)) + ((v[0] & v[1]) ^ (v[0] & v[2]) ^ (v[1] & v[2]))
+    return ti.Vector([temp1 + temp2, v[0], v[1], v[2], v[3] + temp1, v[4], v[5], v[6]], dt=ti.uint32)
+
+
+@ti.func
+def compress(state, block):
+    """
+    Compresses one 512-bit block into the hash state, with local variables only
+    :param state: the 8 uint32 words of the hash state
+    :param block: the 16 uint32 words of the block, big endian
+    :return: the new hash state
+    """
+    # only the last 16 words of the message schedule are kept, in a ring
+    w = ti.Vector([block[i] for i in ti.static(range(16))], dt=ti.uint32)
+    v = state
+    for t in ti.static(range(16)):
+        v = _round(v, K[t] + w[t])
+    for r in range(1, 4):
+        for i in ti.static(range(16)):
+            # w[i] of round t = r * 16 + i was w[t - 16]
+            w15 = w[(i + 1) % 16]
+            w2 = w[(i + 14) % 16]
+            s0 = rotate_right(w15, 7) ^ rotate_right(w15, 18) ^ (w15 >> 3)
+            s1 = rotate_right(w2, 17) ^ rotate_right(w2, 19) ^ (w2 >> 10)
+            w[i] = w[i] + s0 + w[(i + 9) % 16] + s1
+            v = _round(v, K[r * 16 + i] + w[i])
+    return state + v
+
+
+@ti.func
+def length_block(length_bits):
+    """
+    :return: the padding block of a message of whole blocks
+    """
+    block = ti.Vector([0] * 16, dt=ti.uint32)
+    block[0] = ti.cast(1, ti.uint32) << 31
+    block[15] = ti.cast(length_bits, ti.uint32)
+    return block
+
+
+@ti.func
+def digest_block(digest, length_bits):
+    """
+    :return: the last block of a message ending with a digest of 32 bytes
+    """
+    block = ti.Vector([0] * 16, dt=ti.uint32)
+    for i in ti.static(range(8)):
+        block[i] = digest[i]
+    block[8] = ti.cast(1, ti.uint32) << 31
+    block[15] = ti.cast(length_bits, ti.uint32)
+    return block
+
+
+@ti.func
+def hash_digest(digest):
+    """
+    :return: the hash of a digest of 32 bytes, for double SHA-256
+    """
+    return compress(initial_state(), digest_block(digest, 256))
+
+
+@ti.func
+def has_leading_zeros(digest, zero_bits) -> ti.int32:
+    """
+    :return: 1 if the first `zero_bits` bits of the digest are all zeros
+    """
+    result = 1
+    for i in ti.static(range(8)):
+        if zero_bits >= (i + 1) * 32:
+            if digest[i] != 0:
+                result = 0
+        elif zero_bits > i * 32:
+            if digest[i] >> ti.cast(32 - (zero_bits - i * 32), ti.uint32) != 0:
+                result = 0
+    return result
+
+
+@ti.kernel
+def _hash_padded_messages(words: ti.types.ndarray(), first_blocks: ti.types.ndarray(), digests: ti.types.ndarray()):
+    """
+    :param words: the padded messages shaped (blocks, 16), swapped to big endian when read
+    :param first_blocks: the first block of each message, and then the amount of blocks
+    """
+    for m in range(digests.shape[0]):
+        # each message is hashed by its own thread
+        state = initial_state()
+        for block in range(first_blocks[m], first_blocks[m + 1]):
+            state = compress(state, ti.Vector([big_endian(words[block, i]) for i in ti.static(range(16))], dt=ti.uint32))
+        for i in ti.static(range(8)):
+            digests[m, i] = state[i]
+
+
+def padding(length: int) -> bytes:
+    """
+    :param length: the amount of bytes of a message
+    :return: 0x80, zeros, and then the length in bits as 8 bytes, up to the end of the last block
+    """
+    return b'\x80' + b'\x00' * ((55 - length) % 64) + (length * 8).to_bytes(8, 'big')
+
+
+def pad_messages(messages: Union[List[Union[bytes, str]], bytes, bytearray, memoryview, np.ndarray],
+                 lengths: np.ndarray = None, prefix_length: int = 0) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Pads all the messages into one buffer
+    :param messages: a list of messages, or a buffer of all the messages one after another if `lengths` is given
+    :param lengths: the amount of bytes of each message in the buffer
+    :param prefix_length: the amount of bytes already hashed before each message, a multiple of 64
+    :return: the padded messages as uint32 words in the native little-endian order shaped (blocks, 16),
+        and the first block of each message followed by the amount of blocks
+    """
+    if lengths is None:
+        messages = [m.encode() if type(m) is str else m for m in messages]
+        lengths = [len(m) for m in messages]
+    else:
+        buffer = memoryview(messages).cast('B')
+        lengths = np.asarray(lengths, dtype=np.int64).tolist()
+        ends = np.cumsum(lengths).tolist()
+        messages = [buffer[end - length:end] for end, length in zip(ends, lengths)]
+    padded = b''.join([part for m, length in zip(messages, lengths) for part in (m, padding(prefix_length + length))])
+    first_blocks = np.zeros(len(lengths) + 1, dtype=np.int32)
+    first_blocks[1:] = np.cumsum((np.asarray(lengths, dtype=np.int64) + 1 + 8 + 63) // 64)
+    return np.frombuffer(padded, dtype=np.uint32).reshape(-1, 16), first_blocks
+
+
+def hash_batch(messages: Union[List[Union[bytes, str]], bytes, bytearray, memoryview, np.ndarray],
+               lengths: np.ndarray = None) -> np.ndarray:
+    """
+    Hashes many independent messages with one kernel launch
+    :param messages: a list of messages, or a buffer of all the messages one after another if `lengths` is given
+    :param lengths: the amount of bytes of each message in the buffer
+    :return: the digests of the messages, as uint32 words shaped (messages, 8)
+    """
+    words, first_blocks = pad_messages(messages, lengths)
+    digests = np.zeros((first_blocks.shape[0] - 1, 8), dtype=np.uint32)
+    if digests.shape[0] > 0:
+        _hash_padded_messages(words, first_blocks, digests)
+    return digests
+
+
+def digests_to_bytes(digests: np.ndarray) -> np.ndarray:
+    """
+    :param digests: uint32 words shaped (messages, 8)
+    :return: the 32 bytes of each digest, shaped (messages, 32)
+    """
+    return digests.astype('>u4').view(np.uint8).reshape(-1, 32)
+
+
+@ti.kernel
+def _hash_key_pads(pads: ti.types.ndarray(), midstates: ti.types.ndarray()):
+    """
+    :param pads: the ipad and opad blocks of each key shaped (keys, 2, 16), in the native little-endian order
+    """
+    for key, pad in ti.ndrange(pads.shape[0], 2):
+        state = compress(initial_state(), ti.Vector([big_endian(pads[key, pad, i]) for i in ti.static(range(16))], dt=ti.uint32))
+        for i in ti.static(range(8)):
+            midstates[key, pad, i] = state[i]
+
+
+@ti.kernel
+def _hmac_padded_messages(words: ti.types.ndarray(), first_blocks: ti.types.ndarray(), key_indices: ti.types.ndarray(),
+                          midstates: ti.types.ndarray(), tags: ti.types.ndarray()):
+    for m in range(tags.shape[0]):
+        key = key_indices[m]
+        inner = ti.Vector([midstates[key, 0, i] for i in ti.static(range(8))], dt=ti.uint32)
+        for block in range(first_blocks[m], first_blocks[m + 1]):
+            inner = compress(inner, ti.Vector([big_endian(words[block, i]) for i in ti.static(range(16))], dt=ti.uint32))
+        # the outer message is the opad block and then the inner digest
+        outer = compress(ti.Vector([midstates[key, 1, i] for i in ti.static(range(8))], dt=ti.uint32),
+                         digest_block(inner, (64 + 32) * 8))
+        for i in ti.static(range(8)):
+            tags[m, i] = outer[i]
+
+
+def hmac_midstates(keys: List[bytes]) -> np.ndarray:
+    """
+    Hashes the ipad and opad blocks of each key once, to be shared by all the messages under the key
+    :return: the hash states after the ipad and the opad blocks of each key, shaped (keys, 2, 8)
+    """
+    keys = [bytes(key) for key in keys]
+    long_keys = [i for i, key in enumerate(keys) if len(key) > 512 // 8]
+    if len(long_keys) > 0:
+        for i, digest in zip(long_keys, digests_to_bytes(hash_batch([keys[i] for i in long_keys]))):
+            keys[i] = digest.tobytes()
+    pads = np.zeros((len(keys), 2, 512 // 8), dtype=np.uint8)
+    for i, key in enumerate(keys):
+        pads[i, :, :len(key)] = np.frombuffer(key, dtype=np.uint8)
+    pads[:, 0] ^= 0x36
+    pads[:, 1] ^= 0x5c
+    midstates = np.zeros((len(keys), 2, 8), dtype=np.uint32)
+    if len(keys) > 0:
+        _hash_key_pads(pads.view(np.uint32), midstates)
+    return midstates
+
+
+def hmac_batch(keys: Union[List[bytes], np.ndarray], messages: Union[List[Union[bytes, str]], bytes, bytearray, memoryview, np.ndarray],
+               key_indices: np.ndarray = None, lengths: np.ndarray = None) -> np.ndarray:
+    """
+    Computes the HMAC-SHA256 tags of many messages with one kernel launch
+    :param keys: the keys, or their midstates returned by `hmac_midstates` to skip hashing the keys again.
+        Keys in a np.ndarray must be midstates
+    :param messages: a list of messages, or a buffer of all the messages one after another if `lengths` is given
+    :param key_indices: the index of the key of each message.
+        Default to the only key for all the messages, or to one key for each message
+    :param lengths: the amount of bytes of each message in the buffer
+    :return: the 32 bytes of each tag, shaped (messages, 32)
+    """
+    if isinstance(keys, np.ndarray):
+        assert keys.dtype == np.uint32 and keys.ndim == 3 and keys.shape[1:] == (2, 8), \
+            'an np.ndarray of keys must be the midstates returned by hmac_midstates, shaped (keys, 2, 8)'
+        midstates = keys
+    else:
+        midstates = hmac_midstates(keys)
+    words, first_blocks = pad_messages(messages, lengths, prefix_length=512 // 8)
+    num_messages = first_blocks.shape[0] - 1
+    if key_indices is None:
+        assert midstates.shape[0] in (1, num_messages), 'key_indices are required'
+        key_indices = np.zeros(num_messages, dtype=np.int32) if midstates.shape[0] == 1 else np.arange(num_messages, dtype=np.int32)
+    tags = np.zeros((num_messages, 8), dtype=np.uint32)
+    if num_messages > 0:
+        _hmac_padded_messages(words, first_blocks, np.asarray(key_indices, dtype=np.int32), midstates, tags)
+    return digests_to_bytes(tags)
+
+
+_staging_buffers: Dict[Tuple[int, ...], ti.Ndarray] = {}
+"""
+_staging_buffers[shape]: a reusable device buffer to which the blocks of `Sha256`, or the chunks of a Merkle tree, are uploaded,
+so that the kernels never get host arrays, which could be copied back to the host after each launch
+"""
+
+
+def _staging_buffer(array: np.ndarray) -> ti.Ndarray:
+    """
+    :return: the device buffer of the shape of the array, holding a copy of it
+    """
+    if array.shape not in _staging_buffers:
+        _staging_buffers[array.shape] = ti.ndarray(dtype=ti.uint32, shape=array.shape)
+    _staging_buffers[array.shape].from_numpy(array)
+    return _staging_buffers[array.shape]
+
+
+def _upload_rows(words: np.ndarray) -> List[Tuple[int, ti.Ndarray]]:
+    """
+    :param words: e.g. blocks shaped (blocks, 16), which may be a view of a read-only memory map
+    :return: the first row and the device buffer of each piece of a power of two rows, in order
+    """
+    buffers = []
+    start = 0
+    while start < words.shape[0]:
+        num_rows = 1 << ((words.shape[0] - start).bit_length() - 1)
+        buffers.append((start, _staging_buffer(words[start:start + num_rows])))
+        start += num_rows
+    return buffers
+
+
+@ti.kernel
+def _reset_state(h: ti.types.ndarray()):
+    for i in range(8):
+        h[i] = H0[i]
+
+
+@ti.kernel
+def _compress_blocks(h: ti.types.ndarray(), words: ti.types.ndarray()):
+    """
+    :param h: the 8 words of the hash state
+    :param words: the blocks shaped (blocks, 16), as uint32 words in the native little-endian order
+    """
+    # the blocks are chained one after another, in a single launch
+    ti.loop_config(serialize=True)
+    for block in range(words.shape[0]):
+        state = compress(ti.Vector([h[i] for i in ti.static(range(8))], dt=ti.uint32),
+                         ti.Vector([big_endian(words[block, i]) for i in ti.static(range(16))], dt=ti.uint32))
+        for i in ti.static(range(8)):
+            h[i] = state[i]
+
+
+@ti.kernel
+def _search_nonces(h: ti.types.ndarray(), template: ti.types.ndarray(), nonce_offset: ti.int32, first_nonce: ti.uint32,
+                   count: ti.int32, zero_bits: ti.int32, big: ti.template(), double: ti.template(),
+                   nonces: ti.types.ndarray(), digests: ti.types.ndarray(), num_results: ti.types.ndarray()):
+    for i in range(count):
+        nonce = first_nonce + ti.cast(i, ti.uint32)
+        state = ti.Vector([h[j] for j in ti.static(range(8))], dt=ti.uint32)
+        for block in range(template.shape[0]):
+            w = ti.Vector([big_endian(template[block, j]) for j in ti.static(range(16))], dt=ti.uint32)
+            for b in ti.static(range(4)):
+                # byte b of the nonce in the message, which may straddle two words or two blocks
+                position = nonce_offset + b - block * 64
+                value = (nonce >> ti.static((3 - b) * 8 if big else b * 8)) & ti.cast(0xff, ti.uint32)
+                for j in ti.static(range(16)):
+                    if position >= j * 4 and position < j * 4 + 4:
+                        w[j] |= value << ti.cast((3 - (position - j * 4)) * 8, ti.uint32)
+            state = compress(state, w)
+        if ti.static(double):
+            state = hash_digest(state)
+        if has_leading_zeros(state, zero_bits):
+            k = ti.atomic_add(num_results[0], 1)
+            if k < nonces.shape[0]:
+                nonces[k] = nonce
+                for j in ti.static(range(8)):
+                    digests[k, j] = state[j]
 
 
-@ti.data_oriented
 class Sha256:
+    """
+    The hash state `h` is a ti.ndarray passed to the module-level kernels,
+    so that all the hashers share the same compiled kernels, and a new hasher or a copy compiles nothing.
+    """
+    chunk_blocks = 2 ** 20  # 64 MB of blocks uploaded and compressed by each kernel launch
+    search_batch_size = 2 ** 22  # nonces tried by each kernel launch of `search_nonces`
     
     def __init__(self):
-        # written for each hash, but not as state variables
-        self.uint32_words = ti.field(dtype=ti.uint32, shape=512 // 32 + 48)  # 64 uint32 words
-        self.s0_words = ti.field(dtype=ti.uint32, shape=16)
-        self.s1_words = ti.field(dtype=ti.uint32, shape=16)
-        self.abcdefgh = ti.field(dtype=ti.uint32, shape=8)
-        self.abcdefgh2 = ti.field(dtype=ti.uint32, shape=8)
-
         # state variables
         self.hash_finished = False
-        self.h = ti.field(dtype=ti.uint32, shape=8)
-        for i, h_ in enumerate([0x6a09e667, 0xbb67ae85, 0x3c6ef372, 0xa54ff53a, 0x510e527f, 0x9b05688c, 0x1f83d9ab, 0x5be0cd19, ]):
-            self.h[i] = h_
+        self.h = ti.ndarray(dtype=ti.uint32, shape=8)
         self.unhandled_bytes = bytearray()
         self.original_length_bits = 0
-        # self.reset()
+        self.reset()
         
     def reset(self):
         self.hash_finished = False
-        for i, h_ in enumerate([0x6a09e667, 0xbb67ae85, 0x3c6ef372, 0xa54ff53a, 0x510e527f, 0x9b05688c, 0x1f83d9ab, 0x5be0cd19, ]):
-            self.h[i] = h_
+        _reset_state(self.h)
         self.unhandled_bytes = bytearray()
         self.original_length_bits = 0
         return self
 
-    def update(self, b: Union[bytearray, bytes, str, memoryview]):
+    def copy(self):
+        """
+        :return: a new hasher of the same bytes so far, e.g. to branch from the hash of a common prefix
+        """
+        other = Sha256.__new__(Sha256)
+        other.h = ti.ndarray(dtype=ti.uint32, shape=8)
+        other.h.copy_from(self.h)
+        other.hash_finished = self.hash_finished
+        other.unhandled_bytes = bytearray(self.unhandled_bytes)
+        other.original_length_bits = self.original_length_bits
+        return other
+    
+    def midstate(self) -> Tuple[np.ndarray, bytes, int]:
+        """
+        :return: the hash state after the whole blocks so far as 8 uint32 words, the bytes after these blocks,
+            and the amount of bytes so far
+        """
+        assert self.hash_finished is False
+        return self.h.to_numpy(), bytes(self.unhandled_bytes), self.original_length_bits // 8
+    
+    def set_midstate(self, h: np.ndarray, unhandled_bytes: bytes, length: int):
+        """
+        Continues from a midstate exported by `midstate()`
+        """
+        self.hash_finished = False
+        self.h.from_numpy(np.asarray(h, dtype=np.uint32))
+        self.unhandled_bytes = bytearray(unhandled_bytes)
+        self.original_length_bits = length * 8
+        return self
+
+    def update(self, b: Union[bytearray, bytes, str, memoryview, np.ndarray]):
+        """
+        :param b: also anything with the buffer protocol, e.g. mmap.mmap or np.memmap,
+            which is not copied on the host but uploaded to the device in chunks of at most `chunk_blocks` blocks
+        """
         assert self.hash_finished is False
         if type(b) is str:
             b: bytes = b.encode()
-        if type(b) is bytes or type(b) is memoryview:
-            b: bytearray = bytearray(b)
-        original_length_b_bytes = len(b)
-        self.original_length_bits += original_length_b_bytes * 8
-        b: memoryview = memoryview(self.unhandled_bytes + b)
-        
-        blocks = (original_length_b_bytes + len(self.unhandled_bytes)) // (512 // 8)
-        for _ in range(blocks):
-            for i in range(512 // 32):
-                self.uint32_words[i] = int.from_bytes(b[i * 4:i * 4 + 4], 'big', signed=False)
-            self.hash()
-            b = b[(512 // 8):]
-        self.unhandled_bytes = bytearray(b)
+        b: memoryview = memoryview(b).cast('B')
+        self.original_length_bits += len(b) * 8
+        if len(self.unhandled_bytes) > 0:
+            # complete the block left by the former update
+            taken = min(512 // 8 - len(self.unhandled_bytes), len(b))
+            self.unhandled_bytes += b[:taken]
+            b = b[taken:]
+            if len(self.unhandled_bytes) < 512 // 8:
+                return self
+            self._compress(self.unhandled_bytes)
+            self.unhandled_bytes = bytearray()
+        blocks_length = len(b) // (512 // 8) * (512 // 8)
+        for start in range(0, blocks_length, self.chunk_blocks * (512 // 8)):
+            self._compress(b[start:min(start + self.chunk_blocks * (512 // 8), blocks_length)])
+        self.unhandled_bytes = bytearray(b[blocks_length:])
         return self
     
-    def finish(self, b: Union[bytearray, bytes, str, memoryview]):
-        assert self.hash_finished is False
+    def update_file(self, path: str):
+        """
+        Hashes a file through a memory map, so that it is never read into memory at once
+        """
+        if os.path.getsize(path) > 0:
+            self.update(np.memmap(path, dtype=np.uint8, mode='r'))
+        return self
+    
+    def finish(self, b: Union[bytearray, bytes, str, memoryview, np.ndarray] = b''):
+        self.update(b)
         self.hash_finished = True
-        if type(b) is str:
-            b: bytes = b.encode()
-        if type(b) is bytes or type(b) is memoryview:
-            b: bytearray = bytearray(b)
-        original_length_bits = len(b) * 8 + self.original_length_bits  # len of bits
-        b: bytearray = self.unhandled_bytes + b
-        
-        b.append(0x80)
-        # now we want len_bits+64 is a multiple of 512
-        # if not, we append 0x00 at the end of the input message
-        length_bits = original_length_bits + 8  # in bits
-        len_bits_append = ((length_bits + 64) % 512)  # in bits
-        if len_bits_append != 0:
-            len_bits_append = 512 - len_bits_append  # in bits
-            b += b'\x00' * (len_bits_append // 8)
-        b += original_length_bits.to_bytes(8, 'big')  # pad to 8 bytes or 64 bits
-        length_bits = len(b)
-        assert (length_bits * 8) % 512 == 0, "Padding error!"
-        
-        b: memoryview = memoryview(b)
-        blocks = len(b) // (512 // 8)
-        for _ in range(blocks):
-            for i in range(512 // 32):
-                self.uint32_words[i] = int.from_bytes(b[i * 4:i * 4 + 4], 'big', signed=False)
-            self.hash()
-            b = b[(512 // 8):]
-        assert len(b) == 0, "Error at finish!"
+        self._compress(self.unhandled_bytes + padding(self.original_length_bits // 8))
+        self.unhandled_bytes = bytearray()
         return self
     
-    @ti.kernel
-    def hash(self):
-        for i in ti.static(range(16, 32)):
-            self.s0_words[i - 16] = self._rotate_right(self.uint32_words[i - 15], 7) ^ self._rotate_right(self.uint32_words[i - 15], 18) ^ self._shift_right(self.uint32_words[i - 15], 3)
-            self.s1_words[i - 16] = self._rotate_right(self.uint32_words[i - 2], 17) ^ self._rotate_right(self.uint32_words[i - 2], 19) ^ self._shift_right(self.uint32_words[i - 2], 10)
-            self.uint32_words[i] = self.uint32_words[i - 16] + self.s0_words[i - 16] + self.uint32_words[i - 7] + self.s1_words[i - 16]
-        for i in ti.static(range(32, 48)):
-            self.s0_words[i - 32] = self._rotate_right(self.uint32_words[i - 15], 7) ^ self._rotate_right(self.uint32_words[i - 15], 18) ^ self._shift_right(self.uint32_words[i - 15], 3)
-            self.s1_words[i - 32] = self._rotate_right(self.uint32_words[i - 2], 17) ^ self._rotate_right(self.uint32_words[i - 2], 19) ^ self._shift_right(self.uint32_words[i - 2], 10)
-            self.uint32_words[i] = self.uint32_words[i - 16] + self.s0_words[i - 32] + self.uint32_words[i - 7] + self.s1_words[i - 32]
-        for i in ti.static(range(48, 64)):
-            self.s0_words[i - 48] = self._rotate_right(self.uint32_words[i - 15], 7) ^ self._rotate_right(self.uint32_words[i - 15], 18) ^ self._shift_right(self.uint32_words[i - 15], 3)
-            self.s1_words[i - 48] = self._rotate_right(self.uint32_words[i - 2], 17) ^ self._rotate_right(self.uint32_words[i - 2], 19) ^ self._shift_right(self.uint32_words[i - 2], 10)
-            self.uint32_words[i] = self.uint32_words[i - 16] + self.s0_words[i - 48] + self.uint32_words[i - 7] + self.s1_words[i - 48]
-        for i in self.h:
-            self.abcdefgh[i] = self.h[i]
-        # abcdefgh
-        # 01234567
-        ti.loop_config(serialize=True)
-        for t in range(32):
-            # ping-pong operations
-            temp1 = self.abcdefgh[7] + self._S1(self.abcdefgh[4]) + self._ch(self.abcdefgh[4], self.abcdefgh[5], self.abcdefgh[6]) + K[t * 2] + self.uint32_words[t * 2]
-            temp2 = self._S0(self.abcdefgh[0]) + self._maj(self.abcdefgh[0], self.abcdefgh[1], self.abcdefgh[2])
-            for i in ti.static(range(8)):
-                if i == 0:
-                    self.abcdefgh2[0] = temp1 + temp2
-                elif i == 4:
-                    self.abcdefgh2[4] = self.abcdefgh[3] + temp1
-                else:
-                    self.abcdefgh2[i] = self.abcdefgh[i - 1]
-            temp1 = self.abcdefgh2[7] + self._S1(self.abcdefgh2[4]) + self._ch(self.abcdefgh2[4], self.abcdefgh2[5], self.abcdefgh2[6]) + K[t * 2 + 1] + self.uint32_words[t * 2 + 1]
-            temp2 = self._S0(self.abcdefgh2[0]) + self._maj(self.abcdefgh2[0], self.abcdefgh2[1], self.abcdefgh2[2])
-            for i in ti.static(range(8)):
-                if i == 0:
-                    self.abcdefgh[0] = temp1 + temp2
-                elif i == 4:
-                    self.abcdefgh[4] = self.abcdefgh2[3] + temp1
-                else:
-                    self.abcdefgh[i] = self.abcdefgh2[i - 1]
-        for i in ti.static(range(8)):
-            self.h[i] = self.h[i] + self.abcdefgh[i]
+    def search_nonces(self, first_nonce: int, count: int, zero_bits: int, suffix: bytes = b'', byteorder: str = 'little',
+                      double: bool = False, max_results: int = 1024) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Hashes the bytes so far followed by a 4-byte nonce and then `suffix`, for all the nonces
+        first_nonce, ..., first_nonce + count - 1 in parallel, all starting from the midstate of the bytes so far.
+        The state of this hasher is not changed.
+        :param zero_bits: the amount of leading zero bits of the wanted digests
+        :param byteorder: of the nonce, 'little' like the nonce in a Bitcoin block header, or 'big'
+        :param double: hash the digests again, like Bitcoin
+        :return: the first `max_results` nonces whose digests have `zero_bits` leading zero bits, in ascending order,
+            and their digests
+        """
+        assert self.hash_finished is False
+        assert 0 <= first_nonce and first_nonce + count <= 2 ** 32
+        length = self.original_length_bits // 8 + 4 + len(suffix)
+        # the blocks after the midstate, with zeros in place of the nonce
+        tail = self.unhandled_bytes + b'\x00' * 4 + suffix + padding(length)
+        template = np.frombuffer(bytes(tail), dtype=np.uint32).reshape(-1, 512 // 32)
+        # hits of one launch, in the order of the atomic adds
+        nonces = np.zeros(max_results, dtype=np.uint32)
+        digests = np.zeros((max_results, 8), dtype=np.uint32)
+        num_results = np.zeros(1, dtype=np.int32)
+        found_nonces, found_digests = [], []
+        num_found = 0
+        batch_size = self.search_batch_size
+        start = first_nonce
+        while start < first_nonce + count and num_found < max_results:
+            batch_count = min(batch_size, first_nonce + count - start)
+            num_results[0] = 0
+            _search_nonces(self.h, template, len(self.unhandled_bytes), start, batch_count,
+                           zero_bits, byteorder == 'big', double, nonces, digests, num_results)
+            if num_results[0] > max_results:
+                # some hits of this launch are lost, and they may be the first ones. Retry fewer nonces
+                batch_size = max(1, batch_count // 2)
+                continue
+            # the launches are in ascending order of the nonces, so only the hits of each launch need sorting
+            order = np.argsort(nonces[:num_results[0]])[:max_results - num_found]
+            found_nonces.append(nonces[order])
+            found_digests.append(digests[order])
+            num_found += order.shape[0]
+            start += batch_count
+        if num_found == 0:
+            return nonces[:0], digests[:0]
+        return np.concatenate(found_nonces), np.concatenate(found_digests)
     
-    @ti.func
-    def _S0(self, a: ti.uint32):
-        return self._rotate_right(a, 2) ^ self._rotate_right(a, 13) ^ self._rotate_right(a, 22)
+    def _compress(self, blocks: Union[bytearray, memoryview]):
+        # reinterpreted without copying, uploaded, and swapped to big endian by the kernel
+        for _, buffer in _upload_rows(np.frombuffer(blocks, dtype=np.uint32).reshape(-1, 512 // 32)):
+            _compress_blocks(self.h, buffer)
+
+
+@ti.data_oriented
+class Sha256Pool:
+    """
+    Many independent streams hashed together. `update` and `finish` may be called from any thread.
+    The whole blocks of all the streams are gathered, and compressed by shared kernel launches,
+    one thread for each stream, with the hash states of all the streams in one field.
+    """
     
-    @ti.func
-    def _S1(self, e: ti.uint32):
-        return self._rotate_right(e, 6) ^ self._rotate_right(e, 11) ^ self._rotate_right(e, 25)
+    def __init__(self, capacity: int = 1024, flush_bytes: int = 2 ** 24):
+        """
+        :param capacity: the amount of streams open at the same time
+        :param flush_bytes: the pending bytes of all the streams which trigger a launch
+        """
+        self.capacity = capacity
+        self.flush_bytes = flush_bytes
+        self.h = ti.field(dtype=ti.uint32, shape=(8, capacity))  # h[i, stream] is word i of the hash state of the stream
+        self.lock = threading.RLock()
+        self.free_streams = list(range(capacity - 1, -1, -1))
+        # state variables of the open streams
+        self.unhandled_bytes: Dict[int, bytearray] = {}
+        self.original_length_bits: Dict[int, int] = {}
+        self.new_streams = set()  # the streams whose hash states are not initialized yet
+        self.pending_bytes = 0
+        # taichi allocates the field and compiles the kernel only in the thread which has called ti.init
+        self._compress_streams(np.zeros((0, 512 // 32), dtype=np.uint32), np.zeros(1, dtype=np.int32),
+                               np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.int32))
     
-    @staticmethod
-    @ti.func
-    def _ch(e: ti.uint32, f: ti.uint32, g: ti.uint32):
-        return (e & f) ^ (~e & g)
+    def open(self) -> int:
+        """
+        :return: a new stream
+        """
+        with self.lock:
+            if len(self.free_streams) == 0:
+                raise RuntimeError(f'all the {self.capacity} streams are open')
+            stream = self.free_streams.pop()
+            self.unhandled_bytes[stream] = bytearray()
+            self.original_length_bits[stream] = 0
+            self.new_streams.add(stream)
+            return stream
     
-    @staticmethod
-    @ti.func
-    def _maj(a: ti.uint32, b: ti.uint32, c: ti.uint32):
-        return (a & b) ^ (a & c) ^ (b & c)
+    def update(self, stream: int, b: Union[bytearray, bytes, str, memoryview, np.ndarray]):
+        if type(b) is str:
+            b: bytes = b.encode()
+        b: memoryview = memoryview(b).cast('B')
+        with self.lock:
+            self.unhandled_bytes[stream] += b
+            self.original_length_bits[stream] += len(b) * 8
+            self.pending_bytes += len(b)
+            if self.pending_bytes >= self.flush_bytes:
+                self.flush()
+        return self
     
-    @staticmethod
-    @ti.func
-    def _rotate_right(num: ti.uint32, shift: ti.uint32, size: ti.uint8 = 32):
-        return (num >> shift) | (num << (size - shift))
+    def finish(self, stream: int, b: Union[bytearray, bytes, str, memoryview, np.ndarray] = b'') -> np.ndarray:
+        """
+        :return: the digest of the stream as 8 uint32 words. The stream is closed
+        """
+        self.update(stream, b)
+        with self.lock:
+            self.unhandled_bytes[stream] += padding(self.original_length_bits[stream] // 8)
+            self.flush()
+            digest = self.h.to_numpy()[:, stream]
+            del self.unhandled_bytes[stream]
+            del self.original_length_bits[stream]
+            self.free_streams.append(stream)
+            return digest
     
-    @staticmethod
-    @ti.func
-    def _shift_right(i: ti.uint32, shift: ti.uint8) -> ti.uint32:
-        return i >> shift
+    def flush(self):
+        """
+        Compresses the whole blocks of all the streams
+        """
+        with self.lock:
+            streams = [stream for stream, b in self.unhandled_bytes.items() if len(b) >= 512 // 8]
+            if len(streams) == 0:
+                return
+            blocks = []
+            first_blocks = np.zeros(len(streams) + 1, dtype=np.int32)
+            for k, stream in enumerate(streams):
+                b = self.unhandled_bytes[stream]
+                blocks_length = len(b) // (512 // 8) * (512 // 8)
+                blocks.append(b[:blocks_length])
+                self.unhandled_bytes[stream] = b[blocks_length:]
+                first_blocks[k + 1] = first_blocks[k] + blocks_length // (512 // 8)
+            new = np.array([stream in self.new_streams for stream in streams], dtype=np.int32)
+            self.new_streams.difference_update(streams)
+            self.pending_bytes = sum(len(b) for b in self.unhandled_bytes.values())
+            # swapped to big endian by the kernel
+            words = np.frombuffer(b''.join(blocks), dtype=np.uint32).reshape(-1, 512 // 32)
+            self._compress_streams(words, first_blocks, np.array(streams, dtype=np.int32), new)
+    
+    @ti.kernel
+    def _compress_streams(self, words: ti.types.ndarray(), first_blocks: ti.types.ndarray(), streams: ti.types.ndarray(),
+                          new: ti.types.ndarray()):
+        """
+        :param words: the blocks of each stream one after another shaped (blocks, 16), in the native little-endian order
+        :param new: 1 if the hash state of the stream is not initialized yet
+        """
+        for k in range(streams.shape[0]):
+            stream = streams[k]
+            state = ti.Vector([self.h[i, stream] for i in ti.static(range(8))], dt=ti.uint32)
+            if new[k]:
+                state = initial_state()
+            for block in range(first_blocks[k], first_blocks[k + 1]):
+                state = compress(state, ti.Vector([big_endian(words[block, i]) for i in ti.static(range(16))], dt=ti.uint32))
+            for i in ti.static(range(8)):
+                self.h[i, stream] = state[i]
+
+
+@ti.kernel
+def _hash_leaves(words: ti.types.ndarray(), first_leaf: ti.int32, leaves: ti.types.ndarray(), double: ti.template()):
+    """
+    :param words: the chunks of whole blocks shaped (chunks, words of a chunk), in the native little-endian order
+    """
+    for chunk in range(words.shape[0]):
+        state = initial_state()
+        for block in range(words.shape[1] // 16):
+            state = compress(state, ti.Vector([big_endian(words[chunk, block * 16 + i]) for i in ti.static(range(16))], dt=ti.uint32))
+        state = compress(state, length_block(words.shape[1] * 32))
+        if ti.static(double):
+            state = hash_digest(state)
+        for i in ti.static(range(8)):
+            leaves[first_leaf + chunk, i] = state[i]
+
+
+@ti.kernel
+def _hash_last_leaf(words: ti.types.ndarray(), leaves: ti.types.ndarray(), double: ti.template()):
+    """
+    :param words: the padded last chunk shaped (blocks, 16), in the native little-endian order
+    """
+    for leaf in range(leaves.shape[0] - 1, leaves.shape[0]):
+        # a single thread, as the blocks are chained
+        state = initial_state()
+        for block in range(words.shape[0]):
+            state = compress(state, ti.Vector([big_endian(words[block, i]) for i in ti.static(range(16))], dt=ti.uint32))
+        if ti.static(double):
+            state = hash_digest(state)
+        for i in ti.static(range(8)):
+            leaves[leaf, i] = state[i]
+
+
+@ti.kernel
+def _hash_parents(children: ti.types.ndarray(), parents: ti.types.ndarray(), double: ti.template()):
+    for parent in range(parents.shape[0]):
+        # the last child is paired with itself if the amount of children is odd
+        right = ti.min(parent * 2 + 1, children.shape[0] - 1)
+        block = ti.Vector([0] * 16, dt=ti.uint32)
+        for i in ti.static(range(8)):
+            block[i] = children[parent * 2, i]
+            block[i + 8] = children[right, i]
+        state = compress(compress(initial_state(), block), length_block(512))
+        if ti.static(double):
+            state = hash_digest(state)
+        for i in ti.static(range(8)):
+            parents[parent, i] = state[i]
+
+
+def _build_merkle_tree(data: Union[bytes, bytearray, memoryview, np.ndarray], chunk_size: int, double: bool) -> List[ti.Ndarray]:
+    """
+    :return: the hashes of each level on the device, from the leaves to the root
+    """
+    assert chunk_size % (512 // 8) == 0, 'chunks must be whole blocks'
+    data = memoryview(data).cast('B')
+    num_chunks = max(1, (len(data) + chunk_size - 1) // chunk_size)
+    level = ti.ndarray(dtype=ti.uint32, shape=(num_chunks, 8))
+    num_whole_chunks = len(data) // chunk_size
+    chunks_per_launch = max(1, Sha256.chunk_blocks * (512 // 8) // chunk_size)
+    for first_leaf in range(0, num_whole_chunks, chunks_per_launch):
+        last_leaf = min(first_leaf + chunks_per_launch, num_whole_chunks)
+        # reinterpreted without copying, staged on the device, and swapped to big endian by the kernel
+        words = np.frombuffer(data[first_leaf * chunk_size:last_leaf * chunk_size], dtype=np.uint32)
+        for start, buffer in _upload_rows(words.reshape(last_leaf - first_leaf, chunk_size // 4)):
+            _hash_leaves(buffer, first_leaf + start, level, double)
+    if num_whole_chunks < num_chunks:
+        # the last chunk is shorter, or the data is empty
+        _hash_last_leaf(_staging_buffer(pad_messages([data[num_whole_chunks * chunk_size:]])[0]), level, double)
+    levels = [level]
+    while levels[-1].shape[0] > 1:
+        parents = ti.ndarray(dtype=ti.uint32, shape=((levels[-1].shape[0] + 1) // 2, 8))
+        _hash_parents(levels[-1], parents, double)
+        levels.append(parents)
+    return levels
+
+
+def merkle_root(data: Union[bytes, bytearray, memoryview, np.ndarray], chunk_size: int = 1024, double: bool = False) -> np.ndarray:
+    """
+    Hashes the chunks of the data in parallel, and then each level of the tree in parallel on the device.
+    A parent is the hash of the 64 bytes of its two children, and the last child of an odd level is paired with itself.
+    :param data: anything with the buffer protocol, e.g. mmap.mmap or np.memmap, which is not copied
+    :param chunk_size: bytes of each leaf, a multiple of 64. The last leaf may be shorter
+    :param double: hash every node twice, like Bitcoin
+    :return: the root, as 8 uint32 words
+    """
+    return _build_merkle_tree(data, chunk_size, double)[-1].to_numpy()[0]
+
+
+def merkle_levels(data: Union[bytes, bytearray, memoryview, np.ndarray], chunk_size: int = 1024, double: bool = False) -> List[np.ndarray]:
+    """
+    The same as `merkle_root`, but reads back every level
+    :return: the hashes of each level shaped (nodes, 8), from the leaves to the root
+    """
+    return [level.to_numpy() for level in _build_merkle_tree(data, chunk_size, double)]
+
+
+def merkle_root_file(path: str, chunk_size: int = 1024, double: bool = False) -> np.ndarray:
+    if os.path.getsize(path) == 0:
+        return merkle_root(b'', chunk_size, double)
+    return merkle_root(np.memmap(path, dtype=np.uint8, mode='r'), chunk_size, double)
+
+
+def merkle_proof(levels: List[np.ndarray], leaf: int) -> List[Tuple[np.ndarray, bool]]:
+    """
+    :param levels: returned by `merkle_levels`
+    :return: for each level below the root, the sibling of the node on the path of the leaf, and whether it is on the right
+    """
+    proof = []
+    for level in levels[:-1]:
+        sibling = leaf ^ 1
+        proof.append((level[min(sibling, level.shape[0] - 1)], sibling > leaf))
+        leaf //= 2
+    return proof
+
+
+def merkle_root_hashlib(data: Union[bytes, bytearray, memoryview], chunk_size: int = 1024, double: bool = False) -> bytes:
+    """
+    The same tree as `merkle_root` with hashlib, as a baseline
+    :return: the 32 bytes of the root
+    """
+    from hashlib import sha256
+
+    def h(b) -> bytes:
+        return sha256(sha256(b).digest()).digest() if double else sha256(b).digest()
+
+    data = memoryview(data).cast('B')
+    level = [h(data[i:i + chunk_size]) for i in range(0, max(1, len(data)), chunk_size)]
+    while len(level) > 1:
+        level = [h(level[i] + level[min(i + 1, len(level) - 1)]) for i in range(0, len(level), 2)]
+    return level[0]
 
 
 if __name__ == '__main__':
-    import numpy as np
     np.set_printoptions(formatter={'int': hex})
     s = Sha256()
     print(s.reset().finish(b'hello world').h.to_numpy())  # b94d27b9934d3e08a52e52d7da7dabfac484efe37a5380ee9088f7ace2efcde9
@@ -195,4 +761,65 @@ if __name__ == '__main__':
     for _ in range(1000000):
         sha256(b'a'*720)
     print(f'{time.time() - start_time} seconds for 1000000 sha256 with hashlib')
+
+    messages = [b'a' * 720] * 100000
+    hash_batch(messages[:1])  # JIT compilation
+    start_time = time.time()
+    digests = hash_batch(messages)
+    print(f'{time.time() - start_time} seconds for 100000 sha256 with hash_batch')
+    assert digests_to_bytes(digests)[-1].tobytes() == sha256(b'a' * 720).digest()
+
+    stream = np.random.default_rng(0).integers(256, size=256 * 2 ** 20, dtype=np.uint8)
+    start_time = time.time()
+    h = s.reset().update(stream[:12345]).update(stream[12345:]).finish().h.to_numpy()
+    print(f'{time.time() - start_time} seconds for a 256 MB stream with gpu')
+    start_time = time.time()
+    assert h.astype('>u4').tobytes() == sha256(stream).digest()
+    print(f'{time.time() - start_time} seconds for a 256 MB stream with hashlib')
+
+    pool = Sha256Pool(capacity=256)
+    streams = [pool.open() for _ in range(256)]
+    start_time = time.time()
+    for r in range(16):
+        for k, st in enumerate(streams):
+            pool.update(st, stream[(k * 16 + r) * 2 ** 16:(k * 16 + r + 1) * 2 ** 16])
+    digests = [pool.finish(st) for st in streams]
+    print(f'{time.time() - start_time} seconds for 256 interleaved streams of 1 MB with Sha256Pool')
+    assert digests[-1].astype('>u4').tobytes() == sha256(stream[255 * 2 ** 20:]).digest()
+
+    import hmac
+    messages = [stream[i * 64:i * 64 + 64].tobytes() for i in range(100000)]
+    midstates = hmac_midstates([b'key'])
+    hmac_batch(midstates, messages[:1])  # JIT compilation
+    start_time = time.time()
+    tags = hmac_batch(midstates, messages)
+    print(f'{time.time() - start_time} seconds for 100000 HMAC-SHA256 with hmac_batch')
+    start_time = time.time()
+    for message, tag in zip(messages, tags):
+        assert hmac.new(b'key', message, sha256).digest() == tag.tobytes()
+    print(f'{time.time() - start_time} seconds for 100000 HMAC-SHA256 with hmac')
+
+    # an 80-byte header whose last 4 bytes are the nonce, like Bitcoin
+    header = s.reset().update(stream[:76])
+    header.search_nonces(0, 16, 16, double=True)  # JIT compilation
+    start_time = time.time()
+    nonces, digests = header.search_nonces(0, 2 ** 24, 16, double=True)
+    print(f'{2 ** 24 / (time.time() - start_time) / 1e6} MH/s of double sha256 with gpu, {len(nonces)} nonces found')
+    for nonce, digest in zip(nonces, digests):
+        assert digest.astype('>u4').tobytes() == sha256(sha256(stream[:76].tobytes() + int(nonce).to_bytes(4, 'little')).digest()).digest()
+    prefix = sha256(stream[:76])
+    start_time = time.time()
+    for nonce in range(2 ** 18):
+        h = prefix.copy()
+        h.update(nonce.to_bytes(4, 'little'))
+        sha256(h.digest())
+    print(f'{2 ** 18 / (time.time() - start_time) / 1e6} MH/s of double sha256 with hashlib')
+
+    merkle_root(stream[:4096], double=True)  # JIT compilation
+    start_time = time.time()
+    root = merkle_root(stream, double=True)
+    print(f'{256 / (time.time() - start_time)} MB/s for a double SHA-256 Merkle tree of 1 KB chunks with gpu')
+    start_time = time.time()
+    assert root.astype('>u4').tobytes() == merkle_root_hashlib(stream, double=True)
+    print(f'{256 / (time.time() - start_time)} MB/s for a double SHA-256 Merkle tree of 1 KB chunks with hashlib')
     # ti.profiler.print_scoped_profiler_info()
@@ -0,0 +1,214 @@
+"""
+Verifies SHA256.py against the examples of FIPS 180-4 and against hashlib, and benchmarks it
+on the CPU and every other available backend over a grid of message sizes and batch sizes, as JSON.
+
+Each backend is verified and benchmarked in its own process, because SHA256.py initializes taichi when imported.
+The first call of each function is not timed, because it includes the JIT compilation.
+A single `Sha256` is reused with `reset()` by all the checks and timings of a backend.
+The exit code is 1 if any check fails on any backend.
+
+python benchmark.py --output sha256_benchmark.json
+"""
+import argparse
+import hashlib
+import hmac
+import importlib
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Callable, Dict, List
+import numpy as np
+
+gpu_arch_names = ['cuda', 'vulkan', 'metal', 'opengl', 'dx11']
+message_sizes = [0, 64, 1024, 2 ** 16, 2 ** 20, 4 * 2 ** 20]
+batch_sizes = [1, 64, 4096]
+
+# (message, digest) of the SHA-256 examples of FIPS 180-4
+fips_vectors = [
+    (b'abc', 'ba7816bf8f01cfea414140de5dae2223b00361a396177a9cb410ff61f20015ad'),
+    (b'', 'e3b0c44298fc1c149afbf4c8996fb92427ae41e4649b934ca495991b7852b855'),
+    (b'abcdbcdecdefdefgefghfghighijhijkijkljklmklmnlmnomnopnopq',
+     '248d6a61d20638b8e5c026930c3e6039a33ce45964ff2167f6ecedd419db06c1'),
+    (b'abcdefghbcdefghicdefghijdefghijkefghijklfghijklmghijklmnhijklmnoijklmnopjklmnopqklmnopqrlmnopqrsmnopqrstnopqrstu',
+     'cf5b16a778af8380036ce59e7b0492370b249b11e8f07a51afac45037afee9d1'),
+    (b'a' * 1000000, 'cdc76e5c9914fb9281a1c7e284d73e67f1809a48a497200e046d39ccc7112cd0'),
+]
+
+
+def to_hex(digest: np.ndarray) -> str:
+    """
+    :param digest: 8 uint32 words
+    """
+    return digest.astype('>u4').tobytes().hex()
+
+
+def verify(sha, hasher) -> Dict[str, bool]:
+    """
+    :param sha: the module SHA256.py
+    :param hasher: a `Sha256` of the module, reset before each use
+    :return: whether each check has passed
+    """
+    rng = np.random.default_rng(0)
+    checks = {}
+    checks['fips_stream'] = all(to_hex(hasher.reset().finish(message).h.to_numpy()) == digest for message, digest in fips_vectors)
+    # the short vectors fed one byte at a time
+    checks['fips_stream_by_byte'] = all(to_hex(update_by_byte(hasher.reset(), message).finish().h.to_numpy()) == digest
+                                        for message, digest in fips_vectors[:4])
+    checks['fips_batch'] = [to_hex(d) for d in sha.hash_batch([m for m, _ in fips_vectors])] == [d for _, d in fips_vectors]
+    pool = sha.Sha256Pool(capacity=len(fips_vectors))
+    streams = [pool.open() for _ in fips_vectors]
+    for stream, (message, _) in zip(streams, fips_vectors):
+        pool.update(stream, message)
+    checks['fips_pool'] = [to_hex(pool.finish(stream)) for stream in streams] == [d for _, d in fips_vectors]
+
+    messages = [rng.bytes(int(n)) for n in rng.integers(0, 1000, size=1000)]
+    expected = [hashlib.sha256(m).digest() for m in messages]
+    checks['random_batch'] = [d.tobytes() for d in sha.digests_to_bytes(sha.hash_batch(messages))] == expected
+    checks['random_packed_batch'] = [d.tobytes() for d in sha.digests_to_bytes(
+        sha.hash_batch(np.frombuffer(b''.join(messages), dtype=np.uint8), [len(m) for m in messages]))] == expected
+    stream_results = []
+    for message in messages[:100]:
+        hasher.reset()
+        cuts = np.sort(rng.integers(0, len(message) + 1, size=3))
+        for start, end in zip([0, *cuts], [*cuts, len(message)]):
+            hasher.update(message[start:end])
+        stream_results.append(hasher.finish().h.to_numpy().astype('>u4').tobytes())
+    checks['random_stream'] = stream_results == expected[:100]
+
+    keys = [rng.bytes(int(n)) for n in rng.integers(0, 200, size=16)]
+    key_indices = rng.integers(len(keys), size=len(messages))
+    tags = sha.hmac_batch(keys, messages, key_indices)
+    checks['hmac'] = all(tag.tobytes() == hmac.new(keys[k], m, hashlib.sha256).digest()
+                         for tag, k, m in zip(tags, key_indices, messages))
+
+    data = rng.bytes(100000)
+    checks['merkle'] = all(sha.merkle_root(data, 1024, double).astype('>u4').tobytes() ==
+                           sha.merkle_root_hashlib(data, 1024, double) for double in [False, True])
+
+    prefix = rng.bytes(76)
+    nonces, _ = hasher.reset().update(prefix).search_nonces(0, 4096, 8, double=True)
+    checks['nonce_search'] = nonces.tolist() == [
+        nonce for nonce in range(4096)
+        if hashlib.sha256(hashlib.sha256(prefix + nonce.to_bytes(4, 'little')).digest()).digest()[0] == 0]
+    return checks
+
+
+def update_by_byte(hasher, message: bytes):
+    for i in range(len(message)):
+        hasher.update(message[i:i + 1])
+    return hasher
+
+
+def best_seconds(function: Callable, repeats: int) -> float:
+    function()  # JIT compilation
+    seconds = []
+    for _ in range(repeats):
+        start_time = time.perf_counter()
+        function()
+        seconds.append(time.perf_counter() - start_time)
+    return min(seconds)
+
+
+def benchmark_backend(max_bytes: int, repeats: int) -> Dict[str, Any]:
+    """
+    Verifies and benchmarks the backend selected by TI_ARCH in this process
+    """
+    start_time = time.perf_counter()
+    sha = importlib.import_module('SHA256')
+    import_seconds = time.perf_counter() - start_time
+    ti = sha.ti
+    results = {
+        'arch': ti.lang.impl.current_cfg().arch.name,
+        'taichi_version': '.'.join(map(str, ti.__version__)),
+        'import_seconds': import_seconds,
+    }
+    if results['arch'] != os.environ.get('TI_ARCH', results['arch']):
+        # taichi fell back to the CPU
+        return results
+    hasher = sha.Sha256()
+    results['checks'] = verify(sha, hasher)
+
+    rng = np.random.default_rng(0)
+    grid = []
+    for message_size in message_sizes:
+        for batch_size in batch_sizes:
+            if message_size * batch_size > max_bytes:
+                continue
+            lengths = np.full(batch_size, message_size)
+            data = np.frombuffer(rng.bytes(message_size * batch_size), dtype=np.uint8)
+            messages = [data[i * message_size:(i + 1) * message_size].tobytes() for i in range(batch_size)]
+            cell = {'message_size': message_size, 'batch_size': batch_size}
+            timings = {
+                'hash_batch': lambda: sha.hash_batch(data, lengths),
+                'hashlib': lambda: [hashlib.sha256(m).digest() for m in messages],
+            }
+            if batch_size == 1:
+                timings['stream'] = lambda: hasher.reset().update(data).finish().h.to_numpy()
+            for name, function in timings.items():
+                seconds = best_seconds(function, repeats)
+                cell[name] = {
+                    'seconds': seconds,
+                    'MB_per_second': message_size * batch_size / seconds / 2 ** 20,
+                    'hashes_per_second': batch_size / seconds,
+                }
+            cell['matches_hashlib'] = [d.tobytes() for d in sha.digests_to_bytes(sha.hash_batch(data, lengths))] == \
+                [hashlib.sha256(m).digest() for m in messages]
+            grid.append(cell)
+    results['grid'] = grid
+    return results
+
+
+def benchmark(arch_names: List[str], max_bytes: int, repeats: int) -> List[Dict[str, Any]]:
+    """
+    :param arch_names: names of TI_ARCH, e.g. ['x64', 'cuda']. Unavailable backends are skipped
+    """
+    all_results = []
+    for arch_name in arch_names:
+        with tempfile.TemporaryDirectory() as directory:
+            output = os.path.join(directory, 'results.json')
+            child = subprocess.run([sys.executable, os.path.abspath(__file__), '--child-output', output,
+                                    '--max-bytes', str(max_bytes), '--repeats', str(repeats)],
+                                   env=dict(os.environ, TI_ARCH=arch_name), stdout=subprocess.DEVNULL)
+            if child.returncode != 0:
+                print(f'Failed to benchmark {arch_name}', file=sys.stderr)
+                continue
+            with open(output) as f:
+                results = json.load(f)
+        if results['arch'] != arch_name:
+            # taichi fell back to the CPU
+            print(f'{arch_name} is not available', file=sys.stderr)
+            continue
+        results['platform'] = platform.platform()
+        all_results.append(results)
+    return all_results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--arch', action='append', help='TI_ARCH to benchmark, default to the CPU and all the GPU backends')
+    parser.add_argument('--max-bytes', type=int, default=64 * 2 ** 20, help='the largest batch of the grid in bytes')
+    parser.add_argument('--repeats', type=int, default=3, help='timed calls of each function, the best one is reported')
+    parser.add_argument('--output', help='write the JSON here instead of stdout')
+    parser.add_argument('--child-output', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child_output is not None:
+        results = benchmark_backend(args.max_bytes, args.repeats)
+        with open(args.child_output, 'w') as f:
+            json.dump(results, f)
+    else:
+        cpu_arch_name = 'arm64' if platform.machine().lower() in ('arm64', 'aarch64') else 'x64'
+        all_results = benchmark(args.arch or [cpu_arch_name] + gpu_arch_names, args.max_bytes, args.repeats)
+        report = json.dumps(all_results, indent=2)
+        if args.output is None:
+            print(report)
+        else:
+            with open(args.output, 'w') as f:
+                f.write(report + '\n')
+        failed = [f'{results["arch"]}: {name}' for results in all_results for name, passed in results['checks'].items() if not passed]
+        if failed:
+            print(f'Failed checks: {", ".join(failed)}', file=sys.stderr)
+            sys.exit(1)